@@ -1,30 +1,53 @@
 import discord
 import logging
+import typing
 from discord.ext import commands
 
-from config import MAX_HP, MAX_ENERGY
+from config import MAX_HP, MAX_ENERGY, DEFAULT_HEALER_ROLE_ID
+from utils.levels import level_change, levels_for
+from utils.permissions import PermissionResolver, AUTHORIZED, HEALER, MODERATOR
 
 logger = logging.getLogger(__name__)
 
+# Discord's message length limit
+MESSAGE_LIMIT = 2000
+
+
+def chunk_message(header, items, separator=", ", limit=MESSAGE_LIMIT):
+    """
+    Split ``header`` followed by ``items`` into messages of at most ``limit``
+    characters, breaking only between items.
+    """
+    chunks = []
+    current = header
+    joiner = "\n"
+    for item in items:
+        if len(current) + len(joiner) + len(item) > limit:
+            chunks.append(current)
+            current, joiner = "", ""
+        current += joiner + item
+        joiner = separator
+    chunks.append(current)
+    return chunks
+
 
 class Admin(commands.Cog):
     """
     Admin commands for the RPG bot.
     Special commands that can only be used by authorized roles.
+
+    The authorized, moderator and healer roles are configured per guild and
+    stored through the DatabaseManager, so they survive restarts.
     """
 
     def __init__(self, bot):
         self.bot = bot
 
-        # List to store authorized role IDs
-        # These would normally be stored in a configuration file or database
-        self.authorized_roles = []
-
-        # Special role ID for healing command
-        self.healing_role_id = 1356952258444525750
-
-        # List to store moderator role IDs for EXP grant
-        self.moderator_roles = []
+        # Role configuration of every guild, loaded once from the database, and each member's cached tier
+        self.permissions = PermissionResolver(
+            bot.db_manager.guild_roles,
+            default_healer_role_id=DEFAULT_HEALER_ROLE_ID
+        )
 
     def cog_check(self, ctx):
         """
@@ -37,8 +60,7 @@ class Admin(commands.Cog):
 
         # Check for authorized roles
         if ctx.guild:
-            user_roles = [role.id for role in ctx.author.roles]
-            return any(role_id in self.authorized_roles for role_id in user_roles)
+            return self.permissions.has(ctx.author, AUTHORIZED)
 
         return False
 
@@ -50,8 +72,7 @@ class Admin(commands.Cog):
 
         # Check for healing role
         if ctx.guild:
-            user_roles = [role.id for role in ctx.author.roles]
-            return self.healing_role_id in user_roles
+            return self.permissions.has(ctx.author, HEALER)
 
         return False
 
@@ -59,7 +80,7 @@ class Admin(commands.Cog):
     async def heal(self, ctx, user: discord.Member = None):
         """
         Fully restore HP and Energy for a user.
-        Only available to the healing role (ID: 1356952258444525750).
+        Only available to the guild's healer role (see sethealerrole).
 
         Usage: Statbot!heal or Statbot!heal @username
         """
@@ -71,16 +92,8 @@ class Admin(commands.Cog):
         if user is None:
             user = ctx.author
 
-        # Get user data
-        user_data = await self.bot.db_manager.get_user(user.id)
-
-        # Restore HP and Energy
-        user_data['hp'] = MAX_HP
-        user_data['energy'] = MAX_ENERGY
-
-        # Update in database
-        await self.bot.db_manager.update_user_stat(user.id, 'hp', MAX_HP)
-        await self.bot.db_manager.update_user_stat(user.id, 'energy', MAX_ENERGY)
+        # Restore HP and Energy in a single update
+        await self.bot.db_manager.update_user_stats(user.id, hp=MAX_HP, energy=MAX_ENERGY)
 
         await ctx.send(f"✨ {user.mention}'s HP and Energy have been fully restored!")
 
@@ -90,11 +103,9 @@ class Admin(commands.Cog):
         if ctx.author.id == self.bot.owner_id:
             return True
 
-        # Check for moderator roles
+        # Check for moderator roles, or Administrator / Manage Server permission
         if ctx.guild:
-            user_roles = [role.id for role in ctx.author.roles]
-            return any(role_id in self.moderator_roles for role_id in user_roles) or any(
-                role.permissions.administrator or role.permissions.manage_guild for role in ctx.author.roles)
+            return self.permissions.has(ctx.author, MODERATOR)
 
         return False
 
@@ -118,30 +129,160 @@ class Admin(commands.Cog):
             await ctx.send("The EXP amount must be positive.")
             return
 
-        # Get user data
-        user_data = await self.bot.db_manager.get_user(user.id)
-
-        # Get current level before adding EXP
-        from utils.helpers import get_current_level
-        current_level = get_current_level(user_data['exp'])
+        # Hold the user's lock so concurrent grants can't overwrite each other
+        async with self.bot.db_manager.user_lock(user.id):
+            # Get user data
+            user_data = await self.bot.db_manager.get_user(user.id)
 
-        # Add EXP
-        user_data['exp'] += amount
-        await self.bot.db_manager.update_user_stat(user.id, 'exp', user_data['exp'])
+            # Calculate new EXP and level, and every level crossed on the way
+            new_exp = user_data['exp'] + amount
+            new_level, crossed = level_change(user_data['exp'], new_exp)
 
-        # Calculate new level
-        new_level = get_current_level(user_data['exp'])
+            # Check if user leveled up
+            level_up = bool(crossed)
 
-        # Check if user leveled up
-        level_up = new_level > current_level
+            # Update EXP (and level, if it changed) in the database together
+            fields = {'exp': new_exp}
+            if level_up:
+                fields['level'] = new_level
+            await self.bot.db_manager.update_user_stats(user.id, **fields)
 
         if level_up:
-            # Update level in the database
-            await self.bot.db_manager.update_user_stat(user.id, 'level', new_level)
             await ctx.send(f"Granted {amount} EXP to {user.mention}. They leveled up to Level {new_level}! 🎉")
         else:
             await ctx.send(f"Granted {amount} EXP to {user.mention}. Current level: {new_level}")
 
+    def _roles(self, guild_id, kind):
+        """Return the role IDs of one kind configured for a guild."""
+        return self.bot.db_manager.get_guild_roles(guild_id).get(kind, frozenset())
+
+    async def _update_roles(self, guild_id, kind, role_ids):
+        """Save one kind of role for a guild and refresh the cached permission tiers."""
+        await self.bot.db_manager.set_guild_roles(guild_id, kind, role_ids)
+        self.permissions.set_roles(guild_id, self.bot.db_manager.get_guild_roles(guild_id))
+
+    def _collect_members(self, targets):
+        """Expand a mix of members and roles into ``{member_id: member}``, leaving out bots."""
+        members = {}
+        for target in targets:
+            for member in (target.members if isinstance(target, discord.Role) else [target]):
+                if not member.bot:
+                    members[member.id] = member
+        return members
+
+    async def _wounded_members(self, guild):
+        """
+        Return ``{member_id: member}`` for every member of a guild below max HP or Energy.
+        Only the guild's members are looked up, not every stored user.
+        """
+        members = [member for member in guild.members if not member.bot]
+        users = await self.bot.db_manager.get_users([member.id for member in members])
+        return {
+            member.id: member
+            for member, user in zip(members, users)
+            if user.hp < MAX_HP or user.energy < MAX_ENERGY
+        }
+
+    async def _send_summary(self, ctx, header, items, separator=", "):
+        """Send a summary split across as many messages as needed, without pinging anyone."""
+        for chunk in chunk_message(header, items, separator):
+            await ctx.send(chunk, allowed_mentions=discord.AllowedMentions.none())
+
+    @commands.command(name="massheal")
+    async def mass_heal(self, ctx, targets: commands.Greedy[typing.Union[discord.Member, discord.Role]],
+                        scope: str = None):
+        """
+        Fully restore HP and Energy for many users at once.
+        Targets can be any mix of roles and members, or "wounded" for every
+        member of this server below max HP or Energy.
+        Only available to the guild's healer role.
+
+        Usage: Statbot!massheal @role @username ... or Statbot!massheal wounded
+        """
+        if not await self.heal_check(ctx):
+            await ctx.send("You don't have permission to use this command. It's restricted to the Healer role only.")
+            return
+
+        members = self._collect_members(targets)
+        if scope == "wounded":
+            if ctx.guild is None:
+                await ctx.send("\"wounded\" only works in a server.")
+                return
+            members.update(await self._wounded_members(ctx.guild))
+        elif scope is not None:
+            await ctx.send(f"Unknown target: {scope}. Use roles, members or \"wounded\".")
+            return
+
+        if not members:
+            await ctx.send("There is nobody to heal.")
+            return
+
+        # Restore everyone in a single batched update
+        await self.bot.db_manager.update_many_stats(
+            {member_id: {'hp': MAX_HP, 'energy': MAX_ENERGY} for member_id in members})
+
+        await self._send_summary(
+            ctx,
+            f"✨ HP and Energy fully restored for {len(members)} members:",
+            [member.mention for member in members.values()]
+        )
+
+    @commands.command(name="massgrantexp")
+    async def mass_grant_exp(self, ctx, amount: int,
+                             targets: commands.Greedy[typing.Union[discord.Member, discord.Role]]):
+        """
+        Grant experience points to many users at once.
+        Targets can be any mix of roles and members.
+        Only available to moderator roles and above.
+        Max 10,000 EXP per grant.
+
+        Usage: Statbot!massgrantexp <amount> @role @username ...
+        """
+        if not await self.moderator_check(ctx):
+            await ctx.send("You don't have permission to use this command. It's restricted to moderator roles only.")
+            return
+
+        # Limit amount to 10,000
+        amount = min(amount, 10000)
+
+        if amount <= 0:
+            await ctx.send("The EXP amount must be positive.")
+            return
+
+        members = self._collect_members(targets)
+        if not members:
+            await ctx.send("There is nobody to grant EXP to.")
+            return
+
+        db = self.bot.db_manager
+
+        # Hold every target's lock so concurrent grants can't overwrite each other
+        async with db.user_locks(members):
+            users = await db.get_users(members)
+
+            # Work out the old and new level of the whole batch in two lookups
+            old_exps = [user['exp'] for user in users]
+            new_exps = [exp + amount for exp in old_exps]
+            old_levels = levels_for(old_exps)
+            new_levels = levels_for(new_exps)
+
+            updates = {}
+            level_ups = []
+            for member_id, new_exp, old_level, new_level in zip(members, new_exps, old_levels, new_levels):
+                fields = {'exp': new_exp}
+                if new_level != old_level:
+                    fields['level'] = new_level
+                    level_ups.append(f"{members[member_id].mention} reached Level {new_level}! 🎉")
+                updates[member_id] = fields
+
+            # Persist every change together
+            await db.update_many_stats(updates)
+
+        header = f"Granted {amount} EXP to {len(members)} members."
+        if level_ups:
+            header += f" {len(level_ups)} leveled up:"
+        await self._send_summary(ctx, header, level_ups, separator="\n")
+
     @commands.command(name="grantrole")
     @commands.is_owner()
     async def grant_role(self, ctx, role: discord.Role):
@@ -151,11 +292,12 @@ class Admin(commands.Cog):
 
         Usage: Statbot!grantrole @role
         """
-        if role.id in self.authorized_roles:
+        roles = self._roles(role.guild.id, "authorized")
+        if role.id in roles:
             await ctx.send(f"The role {role.name} is already authorized.")
             return
 
-        self.authorized_roles.append(role.id)
+        await self._update_roles(role.guild.id, "authorized", roles | {role.id})
         await ctx.send(f"The role {role.name} has been added to the authorized roles list.")
 
     @commands.command(name="grantmodrole")
@@ -167,11 +309,12 @@ class Admin(commands.Cog):
 
         Usage: Statbot!grantmodrole @role
         """
-        if role.id in self.moderator_roles:
+        roles = self._roles(role.guild.id, "moderator")
+        if role.id in roles:
             await ctx.send(f"The role {role.name} is already a moderator role.")
             return
 
-        self.moderator_roles.append(role.id)
+        await self._update_roles(role.guild.id, "moderator", roles | {role.id})
         await ctx.send(f"The role {role.name} has been added to the moderator roles list.")
 
     @commands.command(name="revokerole")
@@ -183,11 +326,12 @@ class Admin(commands.Cog):
 
         Usage: Statbot!revokerole @role
         """
-        if role.id not in self.authorized_roles:
+        roles = self._roles(role.guild.id, "authorized")
+        if role.id not in roles:
             await ctx.send(f"The role {role.name} is not an authorized role.")
             return
 
-        self.authorized_roles.remove(role.id)
+        await self._update_roles(role.guild.id, "authorized", roles - {role.id})
         await ctx.send(f"The role {role.name} has been removed from the authorized roles list.")
 
     @commands.command(name="revokemodrole")
@@ -199,13 +343,52 @@ class Admin(commands.Cog):
 
         Usage: Statbot!revokemodrole @role
         """
-        if role.id not in self.moderator_roles:
+        roles = self._roles(role.guild.id, "moderator")
+        if role.id not in roles:
             await ctx.send(f"The role {role.name} is not a moderator role.")
             return
 
-        self.moderator_roles.remove(role.id)
+        await self._update_roles(role.guild.id, "moderator", roles - {role.id})
         await ctx.send(f"The role {role.name} has been removed from the moderator roles list.")
 
+    @commands.command(name="sethealerrole")
+    @commands.is_owner()
+    async def set_healer_role(self, ctx, role: discord.Role):
+        """
+        Set the role allowed to use the heal command in this server.
+        Only available to the bot owner.
+
+        Usage: Statbot!sethealerrole @role
+        """
+        if self._roles(role.guild.id, "healer") == {role.id}:
+            await ctx.send(f"The role {role.name} is already the healer role.")
+            return
+
+        await self._update_roles(role.guild.id, "healer", {role.id})
+        await ctx.send(f"The role {role.name} is now the healer role.")
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        """Drop a member's cached permission tier when their roles change."""
+        if before.roles != after.roles:
+            self.permissions.invalidate_member(after.guild.id, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        """Drop the cached permission tier of a member who left."""
+        self.permissions.invalidate_member(member.guild.id, member.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        """A role's permissions may have changed who counts as a moderator."""
+        if before.permissions != after.permissions:
+            self.permissions.invalidate_guild(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        """Members lose a deleted role, so their tiers have to be worked out again."""
+        self.permissions.invalidate_guild(role.guild.id)
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         """Handle command errors."""
@@ -0,0 +1,48 @@
+class Aggregates:
+    """
+    Running totals over every stored user.
+
+    DatabaseManager subtracts a user's contribution before changing them and
+    adds it back afterwards, so keeping the totals current costs O(1) per
+    change (inventories hold at most one entry per ITEMS key).
+    """
+
+    __slots__ = ("users", "coins", "items", "levels")
+
+    def __init__(self):
+        self.users = 0
+        self.coins = 0
+        self.items = {}  # item_id -> total quantity held
+        self.levels = {}  # level -> number of users
+
+    def add(self, user, sign=1):
+        """Add a user's contribution to the totals (or subtract it with ``sign=-1``)."""
+        self.users += sign
+        self.coins += sign * (user.coins or 0)
+
+        count = self.levels.get(user.level, 0) + sign
+        if count:
+            self.levels[user.level] = count
+        else:
+            self.levels.pop(user.level, None)
+
+        if user.inventory:
+            for item_id, quantity in user.inventory.items():
+                total = self.items.get(item_id, 0) + sign * quantity
+                if total:
+                    self.items[item_id] = total
+                else:
+                    self.items.pop(item_id, None)
+
+    def remove(self, user):
+        """Subtract a user's contribution from the totals."""
+        self.add(user, -1)
+
+    def as_dict(self):
+        """Return a copy of the totals."""
+        return {
+            "users": self.users,
+            "coins": self.coins,
+            "items": dict(self.items),
+            "levels": dict(sorted(self.levels.items()))
+        }
@@ -1,9 +1,10 @@
+import json
 import os
 from flask import Flask, render_template, jsonify
 import logging
 from dotenv import load_dotenv
-import pickle
-from pathlib import Path
+
+from config import STATS_PATH
 
 # Load environment variables
 load_dotenv()
@@ -23,27 +24,38 @@ def index():
     return render_template('index.html', title="Mortem House Stat - RPG Bot Dashboard")
 
 
+# Last stats published by the bot, reloaded only when the file changes
+_stats_cache = {'mtime': None, 'stats': None}
+
+
+def load_stats():
+    """
+    Return the aggregate stats the bot publishes to STATS_PATH.
+    The file is only re-read when its modification time changes.
+    """
+    try:
+        mtime = os.stat(STATS_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return {'users': 0, 'items': 0, 'commands_used': 0}
+
+    if _stats_cache['mtime'] != mtime:
+        with open(STATS_PATH) as f:
+            stats = json.load(f)
+        _stats_cache['stats'] = {
+            'users': stats.get('users', 0),
+            'items': stats.get('items', 0),
+            'commands_used': stats.get('commands_used', 0)
+        }
+        _stats_cache['mtime'] = mtime
+
+    return _stats_cache['stats']
+
+
 @app.route('/api/stats')
 def stats():
     """API endpoint to get bot statistics."""
     try:
-        # Load the database
-        db_path = Path("rpg_database.pkl")
-        if not db_path.exists():
-            return jsonify({
-                'users': 0,
-                'items': 0,
-                'commands_used': 0
-            })
-
-        with open(db_path, 'rb') as f:
-            data = pickle.load(f)
-
-        return jsonify({
-            'users': len(data.get('users', {})),
-            'items': sum(len(inventory) for inventory in data.get('inventories', {}).values()),
-            'commands_used': len(data.get('cooldowns', {}))
-        })
+        return jsonify(load_stats())
     except Exception as e:
         logger.error(f"Error loading stats: {e}")
         return jsonify({'error': 'Failed to load stats'}), 500
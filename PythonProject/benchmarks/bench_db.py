@@ -0,0 +1,357 @@
+"""
+Benchmark suite for DatabaseManager and the command paths built on it.
+
+For every storage backend and synthetic database size it measures:
+
+- startup: time for ``initialize()`` to open an existing database,
+- get_user: latency of random user lookups,
+- grant_exp: latency of ``Admin.grant_exp`` called with a fake ctx and
+  Member, and bytes written per command once the flusher has caught up,
+- save_data: latency of a save with ``--dirty`` users pending, and bytes
+  written per save,
+- regen: one pass of the ``regenerate_stats`` loop body (settle_regen plus
+  recount_aggregates) after an hour of simulated time.
+
+Everything runs offline in a temporary directory. User data comes from a
+seeded generator and the managers use a fake clock, so runs over the same
+sizes are repeatable. Bytes written are read from /proc/self/io and are only
+reported on Linux.
+
+Results can be saved as a baseline and later runs compared against it;
+any p50, p99 or bytes-per-op figure that grows by more than ``--tolerance``
+fails the run:
+
+    python -m benchmarks.bench_db --sizes 1000,100000 --write-baseline bench_baseline.json
+    python -m benchmarks.bench_db --sizes 1000,100000 --baseline bench_baseline.json --tolerance 0.25
+
+grant_exp needs discord.py installed; it is skipped otherwise.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_memory import build_records
+from utils.db_manager import DatabaseManager
+from utils.segment_manager import SegmentedDatabaseManager
+from utils.sqlite_manager import SQLiteDatabaseManager
+
+BACKENDS = {
+    "pickle": DatabaseManager,
+    "sqlite": SQLiteDatabaseManager,
+    "segments": SegmentedDatabaseManager
+}
+
+# Figures compared against a baseline; for all of them higher is worse
+BASELINE_METRICS = ("p50", "p99", "bytes_per_op")
+
+# Wall-clock time the synthetic users were last regenerated at (see bench_memory)
+START_TIME = 1700000000.0
+
+OWNER_ID = 1
+
+
+class FakeClock:
+    """Stand-in for ``time.time`` that only moves when told to."""
+
+    def __init__(self, now=START_TIME):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeGuild:
+    def __init__(self, guild_id=1):
+        self.id = guild_id
+
+
+class FakeMember:
+    """The parts of ``discord.Member`` the Admin cog uses."""
+
+    def __init__(self, user_id, guild):
+        self.id = user_id
+        self.guild = guild
+        self.roles = []
+        self.bot = False
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user{user_id}"
+
+
+class FakeContext:
+    """A command context whose replies are collected instead of sent."""
+
+    def __init__(self, author):
+        self.author = author
+        self.guild = author.guild
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+class FakeBot:
+    """The parts of the bot the Admin cog uses."""
+
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self.owner_id = OWNER_ID
+
+
+def written_bytes():
+    """Bytes this process has passed to write() so far, or None where /proc/self/io doesn't exist."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(samples, *points):
+    """Return the given whole-number percentiles of ``samples``."""
+    if len(samples) < 2:
+        return [samples[0]] * len(points)
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return [cuts[point - 1] for point in points]
+
+
+def summarise(backend, users, operation, samples, written=None, operations=None):
+    """Turn latency samples in seconds into a result row."""
+    p50, p99 = percentiles(samples, 50, 99)
+
+    return {
+        "backend": backend,
+        "users": users,
+        "operation": operation,
+        "samples": len(samples),
+        "p50": p50,
+        "p99": p99,
+        "bytes_per_op": None if written is None else written / (operations or len(samples))
+    }
+
+
+class Writes:
+    """Measure bytes written between ``start()`` and ``stop()``, if the platform reports them."""
+
+    def start(self):
+        self.before = written_bytes()
+
+    def stop(self):
+        after = written_bytes()
+        return None if self.before is None or after is None else after - self.before
+
+
+async def create_pickle_store(count):
+    """Write a synthetic pickle database of ``count`` users in the current directory; returns their IDs."""
+    db = DatabaseManager(write_behind=False)
+    db.users, db.cooldowns = build_records(count)
+    user_ids = list(db.users)
+    db._force_full = True
+    await db.save_data()
+    await db.close()
+    return user_ids
+
+
+def open_manager(backend, clock):
+    """Create a manager for ``backend`` that only flushes on the dirty threshold."""
+    db = BACKENDS[backend](flush_interval=3600)
+    db.clock = clock
+    return db
+
+
+async def bench_get_user(db, user_ids, rng, lookups):
+    samples = []
+    for _ in range(lookups):
+        user_id = rng.choice(user_ids)
+        started = time.perf_counter()
+        await db.get_user(user_id)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def bench_grant_exp(db, user_ids, rng, commands):
+    """Run Admin.grant_exp through its callback; returns the samples, or None without discord.py."""
+    try:
+        from cogs.admin import Admin
+    except ImportError:
+        return None
+
+    cog = Admin(FakeBot(db))
+    guild = FakeGuild()
+    ctx = FakeContext(FakeMember(OWNER_ID, guild))
+
+    samples = []
+    for _ in range(commands):
+        member = FakeMember(rng.choice(user_ids), guild)
+        started = time.perf_counter()
+        await Admin.grant_exp.callback(cog, ctx, member, rng.randrange(1, 1000))
+        samples.append(time.perf_counter() - started)
+    await db.flush()
+    return samples
+
+
+async def bench_save_data(db, user_ids, rng, rounds, dirty):
+    samples = []
+    for _ in range(rounds):
+        for user_id in rng.sample(user_ids, dirty):
+            await db.update_user_stat(user_id, "coins", rng.randrange(100))
+        started = time.perf_counter()
+        await db.save_data()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def bench_regen(db, clock, rounds):
+    samples = []
+    for _ in range(rounds):
+        clock.advance(3600)
+        started = time.perf_counter()
+        await db.settle_regen()
+        await db.recount_aggregates()
+        samples.append(time.perf_counter() - started)
+    await db.flush()
+    return samples
+
+
+async def bench_backend(backend, count, args):
+    """Benchmark one backend on a fresh copy of a synthetic database; returns result rows."""
+    rows = []
+    rng = random.Random(args.seed)
+    clock = FakeClock()
+    writes = Writes()
+
+    user_ids = await create_pickle_store(count)
+
+    # The first start converts the pickle database for the other backends
+    db = open_manager(backend, clock)
+    await db.initialize()
+    await db.close()
+
+    db = open_manager(backend, clock)
+    started = time.perf_counter()
+    await db.initialize()
+    rows.append(summarise(backend, count, "startup", [time.perf_counter() - started]))
+    db.start_flusher()
+
+    try:
+        rows.append(summarise(backend, count, "get_user",
+                              await bench_get_user(db, user_ids, rng, args.lookups)))
+
+        writes.start()
+        samples = await bench_grant_exp(db, user_ids, rng, args.commands)
+        if samples is not None:
+            rows.append(summarise(backend, count, "grant_exp", samples, writes.stop()))
+
+        writes.start()
+        samples = await bench_save_data(db, user_ids, rng, args.rounds, args.dirty)
+        rows.append(summarise(backend, count, "save_data", samples, writes.stop()))
+
+        samples = await bench_regen(db, clock, args.regen_rounds)
+        rows.append(summarise(backend, count, "regen", samples))
+    finally:
+        await db.close()
+
+    return rows
+
+
+async def run(args):
+    """Run every backend and size, each in its own temporary directory."""
+    rows = []
+    cwd = os.getcwd()
+    for count in args.sizes:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory(prefix="statbot-bench-") as directory:
+                os.chdir(directory)
+                try:
+                    rows.extend(await bench_backend(backend, count, args))
+                finally:
+                    os.chdir(cwd)
+            print(f"  {backend} with {count} users done", file=sys.stderr)
+    return rows
+
+
+def compare(results, baseline, tolerance):
+    """Return a description of every figure that grew more than ``tolerance`` (relative)."""
+    expected = {(row["backend"], row["users"], row["operation"]): row for row in baseline}
+    regressions = []
+
+    for row in results:
+        key = (row["backend"], row["users"], row["operation"])
+        if key not in expected:
+            regressions.append(f"{key[0]} {key[1]} users {key[2]}: not in baseline")
+            continue
+
+        for metric in BASELINE_METRICS:
+            old, new = expected[key].get(metric), row[metric]
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance):
+                regressions.append(f"{key[0]} {key[1]} users {key[2]}: {metric} {old:.6g} -> {new:.6g}")
+
+    return regressions
+
+
+def format_bytes(value):
+    return "-" if value is None else f"{value:.0f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="Comma separated user counts")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Comma separated storage backends")
+    parser.add_argument("--lookups", type=int, default=10000, help="get_user calls per run")
+    parser.add_argument("--commands", type=int, default=1000, help="grant_exp commands per run")
+    parser.add_argument("--rounds", type=int, default=50, help="save_data calls per run")
+    parser.add_argument("--dirty", type=int, default=50, help="Users changed before each save_data")
+    parser.add_argument("--regen-rounds", type=int, default=3, help="Regeneration passes per run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--write-baseline", help="Save the results as a baseline")
+    parser.add_argument("--baseline", help="Compare against a saved baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative growth per figure")
+    args = parser.parse_args()
+
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.backends = args.backends.split(",")
+    for backend in args.backends:
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend!r}")
+
+    results = asyncio.run(run(args))
+
+    print(f"{'backend':>9} {'users':>8} {'operation':>10} {'samples':>7} {'p50 ms':>9} {'p99 ms':>9} {'bytes/op':>10}")
+    for row in results:
+        print(f"{row['backend']:>9} {row['users']:>8} {row['operation']:>10} {row['samples']:>7} "
+              f"{row['p50'] * 1000:>9.3f} {row['p99'] * 1000:>9.3f} {format_bytes(row['bytes_per_op']):>10}")
+
+    for path in (args.json, args.write_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Benchmarks regressed beyond tolerance:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("Benchmarks match the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Memory benchmark for the user store.
+
+Compares the old dict-per-user layout (string keys, separate users,
+inventories and cooldowns dicts) with UserRecord objects keyed by integer
+snowflake plus a CooldownStore, for synthetic databases of 100k and 1M users.
+
+Usage: python -m benchmarks.bench_memory [--sizes 100000,1000000]
+"""
+
+import argparse
+import gc
+import random
+import tracemalloc
+
+from config import MAX_HP, MAX_ENERGY
+from utils.cooldowns import CooldownStore
+from utils.user_record import UserRecord
+
+# Discord snowflakes are ~18-19 digit integers
+SNOWFLAKE_BASE = 100000000000000000
+
+
+def synthetic_users(count, seed=0):
+    """Yield (user_id, hp, energy, exp, coins, has_items, has_cooldown) tuples."""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield (
+            SNOWFLAKE_BASE + i * 4096 + rng.randrange(4096),
+            rng.randrange(MAX_HP + 1),
+            rng.randrange(MAX_ENERGY + 1),
+            rng.randrange(10000),
+            rng.randrange(100),
+            rng.random() < 0.3,
+            rng.random() < 0.5
+        )
+
+
+def build_legacy(count):
+    """Build the old three-dict layout."""
+    data = {"users": {}, "cooldowns": {}, "inventories": {}}
+    for user_id, hp, energy, exp, coins, has_items, has_cooldown in synthetic_users(count):
+        key = str(user_id)
+        data["users"][key] = {"hp": hp, "energy": energy, "exp": exp, "level": 1, "coins": coins,
+                              "last_regen_at": 1700000000.0}
+        data["inventories"][key] = {"energy_drink": 1} if has_items else {}
+        data["cooldowns"][key] = {"searching": 1700000000.0} if has_cooldown else {}
+    return data
+
+
+def build_records(count):
+    """Build the UserRecord layout."""
+    users = {}
+    cooldowns = CooldownStore()
+    for user_id, hp, energy, exp, coins, has_items, has_cooldown in synthetic_users(count):
+        users[user_id] = UserRecord(
+            user_id, hp, energy, exp, 1, coins, 1700000000.0,
+            inventory={"energy_drink": 1} if has_items else None
+        )
+        if has_cooldown:
+            cooldowns.set(user_id, "searching", 1700000000.0, 1700007200.0)
+    return users, cooldowns
+
+
+def measure(builder, count):
+    """Return the bytes allocated by ``builder(count)`` that are still alive."""
+    gc.collect()
+    tracemalloc.start()
+    result = builder(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100000,1000000", help="Comma separated user counts")
+    args = parser.parse_args()
+
+    print(f"{'users':>10} {'dict layout':>14} {'UserRecord':>14} {'per user':>18} {'saved':>7}")
+    for count in (int(size) for size in args.sizes.split(",")):
+        legacy = measure(build_legacy, count)
+        records = measure(build_records, count)
+        print(f"{count:>10} {legacy / 2 ** 20:>11.1f} MB {records / 2 ** 20:>11.1f} MB "
+              f"{legacy // count:>7} -> {records // count:>4} B {1 - records / legacy:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
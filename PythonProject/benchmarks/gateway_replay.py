@@ -0,0 +1,375 @@
+"""
+Offline gateway replay load generator for the whole bot.
+
+Builds the bot with ``bot.setup_bot()`` on top of a synthetic database and
+plays a raid: ``--users`` members of one guild each send ``--messages``
+prefixed commands drawn from COMMAND_MIX. Every message is handed to the
+bot's connection state as a MESSAGE_CREATE gateway payload, so it goes
+through discord.py's own parsing, on_message, command dispatch, converters,
+checks, error handling and reply sending just like in production.
+
+Nothing leaves the machine. The bot never logs in or opens the gateway, the
+guild arrives as a replayed GUILD_CREATE, and REST calls are answered by a
+local stub: sent messages are echoed back so ``ctx.send`` returns a real
+Message, and every other call gets an empty response.
+
+Events go in through the connection state's ``parsers`` and REST calls are
+caught by replacing ``bot.http.request``. Both are discord.py internals; this
+was checked against discord.py 2.7 and may need adjusting for other versions.
+
+Reported:
+
+- throughput: commands finished per second,
+- end-to-end latency from delivery to the end of the command (p50/p95/p99/max),
+  overall and per command,
+- event loop lag (p50/p99/max), sampled every ``--lag-interval`` seconds,
+- DB write amplification: bytes written (from /proc/self/io, Linux only)
+  divided by the pickled size of the user records and cooldowns changed.
+
+The bot's web server listens on an ephemeral port, so a replay doesn't
+clash with a bot running on the same host. Pass ``--web-port`` to scrape
+/metrics while a run is going.
+
+Usage: python -m benchmarks.gateway_replay --users 200 --messages 20 [--rate 0] [--web-port 0] [--json replay.json]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import pickle
+import random
+import tempfile
+import time
+
+import discord
+
+from benchmarks.bench_db import create_pickle_store, percentiles, written_bytes
+from bot import setup_bot
+from config import DEFAULT_PREFIX
+
+# What a raid sends, with relative weights; {target} becomes another raider's mention
+COMMAND_MIX = (
+    ("profile", 25),
+    ("profile {target}", 10),
+    ("inventory", 15),
+    ("searching", 12),
+    ("exercise", 6),
+    ("attack {target}", 18),
+    ("gacha", 8),
+    ("use energy_drink", 4),
+    ("help", 1),
+    ("dance", 1)  # Not a command
+)
+
+GUILD_ID = 900000000000000000
+CHANNEL_ID = 900000000000000001
+BOT_ID = 900000000000000002
+JOINED_AT = "2024-01-01T00:00:00+00:00"
+
+# Route answered with a message payload, so channel.send() gets a Message back
+SEND_MESSAGE_PATH = "/channels/{channel_id}/messages"
+
+
+def user_payload(user_id, bot=False):
+    return {
+        "id": str(user_id),
+        "username": f"raider{user_id % 100000}",
+        "discriminator": "0",
+        "global_name": None,
+        "avatar": None,
+        "bot": bot
+    }
+
+
+def member_payload(user_id=None):
+    """A guild member payload; with ``user_id`` it includes the user, as GUILD_CREATE does."""
+    data = {"roles": [], "joined_at": JOINED_AT, "deaf": False, "mute": False, "flags": 0}
+    if user_id is not None:
+        data["user"] = user_payload(user_id, bot=user_id == BOT_ID)
+    return data
+
+
+def guild_payload(member_ids):
+    return {
+        "id": str(GUILD_ID),
+        "name": "Load test",
+        "owner_id": str(member_ids[0]),
+        "roles": [{
+            "id": str(GUILD_ID), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+            "hoist": False, "managed": False, "mentionable": False, "flags": 0
+        }],
+        "channels": [{
+            "id": str(CHANNEL_ID), "type": 0, "name": "raid", "position": 0,
+            "permission_overwrites": [], "nsfw": False, "parent_id": None
+        }],
+        "members": [member_payload(member_id) for member_id in member_ids],
+        # Matching the members sent means discord.py sees the guild as fully chunked
+        "member_count": len(member_ids),
+        "emojis": [],
+        "stickers": [],
+        "features": []
+    }
+
+
+def message_payload(message_id, author_id, content, mention_ids=()):
+    return {
+        "id": str(message_id),
+        "channel_id": str(CHANNEL_ID),
+        "guild_id": str(GUILD_ID),
+        "author": user_payload(author_id, bot=author_id == BOT_ID),
+        "member": member_payload(),
+        "content": content,
+        "timestamp": discord.utils.utcnow().isoformat(),
+        "edited_timestamp": None,
+        "tts": False,
+        "mention_everyone": False,
+        "mentions": [{**user_payload(user_id), "member": member_payload()} for user_id in mention_ids],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "pinned": False,
+        "type": 0,
+        "flags": 0
+    }
+
+
+class Replay:
+    """Bookkeeping for one run."""
+
+    def __init__(self):
+        self.pending = {}  # message_id -> time delivered
+        self.latencies = {}  # command name -> end-to-end seconds
+        self.sent = 0
+        self.all_sent = False
+        self.errors = 0
+        self.replies = 0
+        self.http_calls = 0
+        self.changes = 0
+        self.logical_bytes = 0
+        self.done = asyncio.Event()
+
+    def finish(self, ctx, failed):
+        """Record the end of the command started by ``ctx.message``."""
+        delivered = self.pending.pop(ctx.message.id, None)
+        if delivered is None:
+            return
+
+        name = ctx.command.qualified_name if ctx.command is not None else "unknown"
+        self.latencies.setdefault(name, []).append(time.perf_counter() - delivered)
+        if failed:
+            self.errors += 1
+        if self.all_sent and not self.pending:
+            self.done.set()
+
+
+def instrument(bot, replay):
+    """
+    Wire the bot to the replay: answer REST calls locally, and track
+    finished commands and the changes handed to the DatabaseManager.
+    """
+    # IDs of the bot's own messages; far below the snowflakes used for the raid
+    reply_ids = itertools.count(1)
+
+    async def request(route, **kwargs):
+        replay.http_calls += 1
+        if route.method == "POST" and route.path == SEND_MESSAGE_PATH:
+            replay.replies += 1
+            return message_payload(next(reply_ids), BOT_ID, "")
+        return {}
+
+    bot.http.request = request
+
+    async def on_command_completion(ctx):
+        replay.finish(ctx, failed=False)
+
+    async def on_command_error(ctx, error):
+        replay.finish(ctx, failed=True)
+
+    bot.add_listener(on_command_completion)
+    bot.add_listener(on_command_error)
+
+    # Count the logical size of every change as it is handed to the DatabaseManager
+    db = bot.db_manager
+    mark_dirty = db._mark_dirty
+
+    async def counting_mark_dirty(*user_ids, cooldowns=()):
+        # Changes inside a transaction are marked again, all together, when it commits
+        if db._transaction.get() is None:
+            for user_id in user_ids:
+                replay.changes += 1
+                replay.logical_bytes += len(pickle.dumps(db.users[user_id].to_tuple()))
+            for user_id, command in cooldowns:
+                replay.changes += 1
+                replay.logical_bytes += len(pickle.dumps((user_id, command, db.cooldowns.entry(user_id, command))))
+        await mark_dirty(*user_ids, cooldowns=cooldowns)
+
+    db._mark_dirty = counting_mark_dirty
+
+
+async def sample_loop_lag(interval, samples):
+    """Record how late the event loop wakes up a task sleeping for ``interval`` seconds."""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(time.perf_counter() - started - interval, 0))
+
+
+async def play(parsers, raiders, replay, rng, args):
+    """Deliver the raid's messages, interleaving the raiders round by round."""
+    templates = [template for template, _ in COMMAND_MIX]
+    weights = [weight for _, weight in COMMAND_MIX]
+    message_id = discord.utils.time_snowflake(discord.utils.utcnow())
+    delay = 1 / args.rate if args.rate else 0
+
+    for _ in range(args.messages):
+        for author_id in rng.sample(raiders, len(raiders)):
+            template = rng.choices(templates, weights)[0]
+            target = rng.choice(raiders)
+            mentions = [target] if "{target}" in template else []
+            content = DEFAULT_PREFIX + template.format(target=f"<@{target}>")
+
+            message_id += 1
+            replay.pending[message_id] = time.perf_counter()
+            replay.sent += 1
+            parsers["MESSAGE_CREATE"](message_payload(message_id, author_id, content, mentions))
+
+            # Like the gateway, hand over one event per loop iteration at most
+            await asyncio.sleep(delay)
+
+    replay.all_sent = True
+    if not replay.pending:
+        replay.done.set()
+
+
+def summary(samples, *points):
+    if not samples:
+        return None
+    values = dict(zip((f"p{point}" for point in points), percentiles(samples, *points)))
+    values["max"] = max(samples)
+    return values
+
+
+async def raid(bot, user_ids, rng, args):
+    """Run one raid against a bot built by setup_bot and return the report."""
+    existing = min(int(args.users * (1 - args.new_fraction)), len(user_ids))
+    first_new_id = discord.utils.time_snowflake(discord.utils.utcnow())
+    raiders = rng.sample(user_ids, existing) + [first_new_id + index * 4096 for index in range(args.users - existing)]
+
+    replay = Replay()
+    instrument(bot, replay)
+
+    state = bot._connection
+    parsers = state.parsers
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, bot=True))
+    parsers["GUILD_CREATE"](guild_payload(raiders + [BOT_ID]))
+
+    lag_samples = []
+    lag_task = asyncio.get_running_loop().create_task(sample_loop_lag(args.lag_interval, lag_samples))
+    before = written_bytes()
+    started = time.perf_counter()
+
+    try:
+        await play(parsers, raiders, replay, rng, args)
+        try:
+            await asyncio.wait_for(replay.done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+    finally:
+        lag_task.cancel()
+
+    await bot.db_manager.flush()
+    after = written_bytes()
+    written = None if before is None or after is None else after - before
+
+    latencies = [latency for samples in replay.latencies.values() for latency in samples]
+    return {
+        "users": args.users,
+        "messages": replay.sent,
+        "finished": len(latencies),
+        "unfinished": len(replay.pending),
+        "errors": replay.errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "latency": summary(latencies, 50, 95, 99),
+        "commands": {
+            name: {"count": len(samples), **summary(samples, 50, 99)}
+            for name, samples in sorted(replay.latencies.items())
+        },
+        "loop_lag": summary(lag_samples, 50, 99),
+        "replies": replay.replies,
+        "http_calls": replay.http_calls,
+        "db": {
+            "backend": type(bot.db_manager).__name__,
+            "changes": replay.changes,
+            "logical_bytes": replay.logical_bytes,
+            "written_bytes": written,
+            "write_amplification": written / replay.logical_bytes if written and replay.logical_bytes else None
+        }
+    }
+
+
+async def run(args):
+    """Build the bot against a synthetic database in a temporary directory and raid it."""
+    rng = random.Random(args.seed)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="statbot-replay-") as directory:
+        os.chdir(directory)
+        try:
+            user_ids = await create_pickle_store(args.db_users)
+            bot = await setup_bot(web_port=args.web_port)
+            async with bot:
+                return await raid(bot, user_ids, rng, args)
+        finally:
+            os.chdir(cwd)
+
+
+def format_ms(values, key):
+    return "-" if values is None else f"{values[key] * 1000:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Raiders sending commands")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per raider")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second; 0 delivers them back to back")
+    parser.add_argument("--new-fraction", type=float, default=0.5, help="Share of raiders not in the database yet")
+    parser.add_argument("--db-users", type=int, default=100000, help="Users in the synthetic database")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="Seconds between event loop lag samples")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for commands to finish")
+    parser.add_argument("--web-port", type=int, default=0, help="Port for the bot's web server; 0 picks a free one")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+
+    print(f"{report['finished']}/{report['messages']} commands finished in {report['seconds']:.2f}s "
+          f"({report['throughput']:.0f}/s), {report['errors']} errors, {report['unfinished']} unfinished")
+    latency = report["latency"]
+    print(f"Latency ms: p50 {format_ms(latency, 'p50')}  p95 {format_ms(latency, 'p95')}  "
+          f"p99 {format_ms(latency, 'p99')}  max {format_ms(latency, 'max')}")
+    lag = report["loop_lag"]
+    print(f"Event loop lag ms: p50 {format_ms(lag, 'p50')}  p99 {format_ms(lag, 'p99')}  max {format_ms(lag, 'max')}")
+
+    print(f"{'command':>12} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, values in report["commands"].items():
+        print(f"{name:>12} {values['count']:>6} {format_ms(values, 'p50'):>8} {format_ms(values, 'p99'):>8}")
+
+    db = report["db"]
+    amplification = db["write_amplification"]
+    print(f"DB ({db['backend']}): {db['changes']} changes, {db['logical_bytes']} bytes changed, "
+          f"{db['written_bytes']} bytes written, write amplification "
+          f"{'-' if amplification is None else f'{amplification:.1f}x'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
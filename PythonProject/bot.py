@@ -2,6 +2,7 @@ import asyncio
 import discord
 import logging
 import os
+import time
 from discord.ext import commands
 
 # Import cogs
@@ -11,29 +12,86 @@ from cogs.inventory import Inventory
 from cogs.gacha import Gacha
 from cogs.admin import Admin
 from utils.db_manager import DatabaseManager
+from utils.metrics import COMMAND_ERRORS, COMMAND_LATENCY, LOOP_LAG_SECONDS, REGEN_SECONDS
+from utils.web_server import WebServer
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
-async def setup_bot():
+class StatBot(commands.Bot):
+    """
+    Bot subclass that starts the background tasks once, and stops the web
+    server and flushes pending database writes on shutdown.
+    """
+
+    async def setup_hook(self):
+        """
+        Start the background tasks. Runs once at login, unlike on_ready,
+        which fires again after every gateway reconnect.
+        """
+        # Background compaction task for HP and Energy regeneration
+        self.background_tasks.append(asyncio.create_task(regenerate_stats(self)))
+
+        # Measure event loop lag
+        self.background_tasks.append(asyncio.create_task(monitor_loop_lag(self)))
+
+    async def close(self):
+        for task in getattr(self, "background_tasks", []):
+            task.cancel()
+
+        web_server = getattr(self, "web_server", None)
+        if web_server is not None:
+            await web_server.close()
+
+        db_manager = getattr(self, "db_manager", None)
+        if db_manager is not None:
+            await db_manager.close()
+
+        await super().close()
+
+
+def create_db_manager():
+    """
+    Create the DatabaseManager for the storage backend selected in the config.
+    """
+    from config import DB_BACKEND
+
+    if DB_BACKEND == "sqlite":
+        from utils.sqlite_manager import SQLiteDatabaseManager
+        return SQLiteDatabaseManager()
+
+    if DB_BACKEND == "segments":
+        from utils.segment_manager import SegmentedDatabaseManager
+        return SegmentedDatabaseManager()
+
+    return DatabaseManager()
+
+
+async def setup_bot(web_port=None):
     """
     Set up and configure the Discord bot with all necessary cogs and settings.
+    The web server listens on ``web_port``, or WEB_PORT from the config when not given.
     """
     intents = discord.Intents.default()
     intents.message_content = True
     intents.members = True
 
     from config import DEFAULT_PREFIX
-    bot = commands.Bot(command_prefix=DEFAULT_PREFIX, intents=intents)
+    bot = StatBot(command_prefix=DEFAULT_PREFIX, intents=intents)
 
     # Initialize database
-    bot.db_manager = DatabaseManager()
+    bot.db_manager = create_db_manager()
     await bot.db_manager.initialize()
+    bot.db_manager.start_flusher()
 
     # Store background tasks
     bot.background_tasks = []
 
+    # Serve health, status, stats and metrics from this event loop
+    bot.web_server = WebServer(bot) if web_port is None else WebServer(bot, port=web_port)
+    await bot.web_server.start()
+
     @bot.event
     async def on_ready():
         """
@@ -42,17 +100,27 @@ async def setup_bot():
         logger.info(f"Logged in as {bot.user.name} (ID: {bot.user.id})")
         logger.info("------")
 
-        # Start background tasks for HP and Energy regeneration
-        bot.background_tasks.append(bot.loop.create_task(regenerate_stats(bot)))
-
         # Set the bot's activity status
         await bot.change_presence(activity=discord.Game(name="RPG Adventure | Statbot!help"))
 
+    @bot.before_invoke
+    async def start_command_timer(ctx):
+        """Record when a command started running."""
+        ctx.started_at = time.perf_counter()
+
+    @bot.after_invoke
+    async def record_command_latency(ctx):
+        """Record how long a command took, whether or not it succeeded."""
+        COMMAND_LATENCY.labels(ctx.command.qualified_name).observe(time.perf_counter() - ctx.started_at)
+
     @bot.event
     async def on_command_error(ctx, error):
         """
         Global error handler for the bot.
         """
+        if ctx.command is not None:
+            COMMAND_ERRORS.labels(ctx.command.qualified_name).inc()
+
         if isinstance(error, commands.CommandOnCooldown):
             minutes, seconds = divmod(error.retry_after, 60)
             hours, minutes = divmod(minutes, 60)
@@ -86,38 +154,38 @@ async def setup_bot():
 
 async def regenerate_stats(bot):
     """
-    Background task for regenerating HP and Energy for all users.
+    Background compaction pass for HP and Energy regeneration.
+
+    Regeneration itself is computed lazily whenever a user is read, so this
+    task only folds the pending amounts into the stored records once in a
+    while and writes them out in a single save.
     """
-    from config import HP_REGEN_RATE, HP_REGEN_INTERVAL, ENERGY_REGEN_RATE, ENERGY_REGEN_INTERVAL, MAX_HP, MAX_ENERGY
+    from config import REGEN_COMPACTION_INTERVAL
 
-    logger.info("Starting stats regeneration task")
+    logger.info("Starting stats regeneration compaction task")
 
-    hp_timer = 0
-    energy_timer = 0
+    while not bot.is_closed():
+        await asyncio.sleep(REGEN_COMPACTION_INTERVAL)
+        started = time.perf_counter()
+
+        changed = await bot.db_manager.settle_regen()
+        logger.debug(f"Regeneration compaction completed, {changed} users updated")
+
+        # Correct any drift in the running totals
+        await bot.db_manager.recount_aggregates()
+
+        REGEN_SECONDS.observe(time.perf_counter() - started)
+
+
+async def monitor_loop_lag(bot):
+    """
+    Measure event loop lag: how much later than requested a sleeping task
+    wakes up. Sustained lag means something is blocking the loop.
+    """
+    from config import LOOP_LAG_INTERVAL
 
+    loop = asyncio.get_running_loop()
     while not bot.is_closed():
-        await asyncio.sleep(60)  # Check every minute
-
-        # Increment timers
-        hp_timer += 60
-        energy_timer += 60
-
-        # HP regeneration cycle
-        if hp_timer >= HP_REGEN_INTERVAL:
-            hp_timer = 0
-            users = await bot.db_manager.get_all_users()
-            for user_id, user_data in users.items():
-                if user_data['hp'] < MAX_HP:
-                    new_hp = min(user_data['hp'] + HP_REGEN_RATE, MAX_HP)
-                    await bot.db_manager.update_user_stat(user_id, 'hp', new_hp)
-            logger.debug(f"HP regeneration cycle completed for {len(users)} users")
-
-        # Energy regeneration cycle
-        if energy_timer >= ENERGY_REGEN_INTERVAL:
-            energy_timer = 0
-            users = await bot.db_manager.get_all_users()
-            for user_id, user_data in users.items():
-                if user_data['energy'] < MAX_ENERGY:
-                    new_energy = min(user_data['energy'] + ENERGY_REGEN_RATE, MAX_ENERGY)
-                    await bot.db_manager.update_user_stat(user_id, 'energy', new_energy)
-            logger.debug(f"Energy regeneration cycle completed for {len(users)} users")
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG_SECONDS.observe(max(loop.time() - expected, 0))
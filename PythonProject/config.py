@@ -10,6 +10,35 @@ HP_REGEN_RATE = 2  # HP points per cycle
 HP_REGEN_INTERVAL = 5 * 60  # 5 minutes in seconds
 ENERGY_REGEN_RATE = 2  # Energy points per cycle
 ENERGY_REGEN_INTERVAL = 3 * 60  # 3 minutes in seconds
+REGEN_COMPACTION_INTERVAL = 60 * 60  # Fold lazy regeneration into storage hourly
+
+# Database settings
+DB_BACKEND = "pickle"  # "pickle", "sqlite" or "segments"
+DB_WRITE_BEHIND = True  # Batch saves in a background flusher instead of saving on every change
+DB_FLUSH_INTERVAL = 5  # Seconds between write-behind flushes
+DB_FLUSH_THRESHOLD = 100  # Flush early once this many users are dirty
+DB_JOURNAL_COMPACT_THRESHOLD = 1000  # Journal records before the pickle snapshot is rewritten
+STATS_PATH = "rpg_stats.json"  # Aggregate stats published for the dashboard
+STATS_PUBLISH_INTERVAL = 5  # Minimum seconds between stats publications
+DB_VIRTUAL_CACHE_SIZE = 1024  # Default records kept for users that have only been read
+DB_CACHE_SIZE = 10_000  # Users the SQLite store keeps in memory
+DB_CACHE_TTL = 30 * 60  # Seconds an unused user stays in memory in the SQLite store
+DB_SEGMENT_DIR = "rpg_segments"  # Directory of the segmented store
+DB_SEGMENT_COUNT = 256  # Hash partitions of the segmented store (fixed once the store exists)
+DB_MAX_RESIDENT_USERS = 100_000  # Users the segmented store keeps in memory before evicting clean segments
+DB_SEGMENT_LEADERBOARD_SIZE = 100  # Best players per segment kept in the segmented store's index
+DB_SEGMENT_FULL_LEADERBOARD = False  # Rank every user in the segmented store (reads all EXP files at startup)
+
+# Web server settings (served from the bot's event loop)
+WEB_HOST = "0.0.0.0"
+WEB_PORT = 8080
+SELF_PING_INTERVAL = 5 * 60  # Seconds between self-pings; 0 disables them
+
+# Monitoring settings
+LOOP_LAG_INTERVAL = 1  # Seconds between event loop lag measurements
+
+# Admin settings
+DEFAULT_HEALER_ROLE_ID = 1356952258444525750  # Healer role for guilds that haven't set one with sethealerrole
 
 # Combat settings
 ATTACK_ENERGY_COST = 10
@@ -0,0 +1,143 @@
+import heapq
+
+from config import SEARCHING_COOLDOWN, EXERCISE_COOLDOWN
+
+# How long each command stays on cooldown after use
+COOLDOWN_DURATIONS = {
+    "searching": SEARCHING_COOLDOWN,
+    "exercise": EXERCISE_COOLDOWN
+}
+
+# Rebuild the heap once stale entries outnumber live ones by this factor
+HEAP_COMPACT_FACTOR = 2
+
+
+def expires_at_for(command, timestamp, duration=None):
+    """
+    Return when a cooldown started at ``timestamp`` runs out.
+    Without an explicit ``duration`` the command's COOLDOWN_DURATIONS entry is
+    used; commands without one get None and never expire on their own.
+    """
+    if duration is None:
+        duration = COOLDOWN_DURATIONS.get(command)
+    return None if duration is None else timestamp + duration
+
+
+class CooldownStore:
+    """
+    Active cooldowns keyed by ``(user_id, command)``.
+
+    Each entry holds the time the command was used and when the cooldown
+    runs out. A min-heap of expiry times lets every call drop the cooldowns
+    that have run out since the last one, so memory only holds cooldowns
+    that are still active.
+
+    Overwriting a cooldown leaves its old heap entry behind; stale entries
+    are skipped when they surface and the heap is rebuilt when they pile up.
+    Times are passed in by the caller, so the store has no clock of its own.
+    """
+
+    def __init__(self):
+        self._entries = {}  # (user_id, command) -> (timestamp, expires_at)
+        self._heap = []  # (expires_at, user_id, command)
+        self._users = {}  # user_id -> number of active cooldowns
+
+    def __len__(self):
+        return len(self._entries)
+
+    def user_count(self):
+        """Number of users with at least one active cooldown."""
+        return len(self._users)
+
+    def evict(self, now):
+        """Drop every cooldown that has run out by ``now``."""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires_at, user_id, command = heapq.heappop(heap)
+            entry = self._entries.get((user_id, command))
+            # Skip heap entries left behind by an overwrite
+            if entry is not None and entry[1] == expires_at:
+                self._remove((user_id, command))
+
+    def _remove(self, key):
+        del self._entries[key]
+        user_id = key[0]
+        count = self._users[user_id] - 1
+        if count:
+            self._users[user_id] = count
+        else:
+            del self._users[user_id]
+
+    def entry(self, user_id, command):
+        """Return ``(timestamp, expires_at)`` for a cooldown, or None."""
+        return self._entries.get((user_id, command))
+
+    def get(self, user_id, command, now):
+        """Return the time a command was last used, or 0 if it isn't on cooldown."""
+        self.evict(now)
+        entry = self._entries.get((user_id, command))
+        return 0 if entry is None else entry[0]
+
+    def set(self, user_id, command, timestamp, expires_at):
+        """Record a cooldown. An ``expires_at`` of None keeps it until overwritten."""
+        key = (user_id, command)
+        if key not in self._entries:
+            self._users[user_id] = self._users.get(user_id, 0) + 1
+        self._entries[key] = (timestamp, expires_at)
+
+        if expires_at is not None:
+            heapq.heappush(self._heap, (expires_at, user_id, command))
+            if len(self._heap) > HEAP_COMPACT_FACTOR * len(self._entries) + 64:
+                self._rebuild_heap()
+
+    def discard(self, user_id, command):
+        """Remove a cooldown if it exists."""
+        if (user_id, command) in self._entries:
+            self._remove((user_id, command))
+
+    def check_and_set(self, user_id, command, now, duration=None):
+        """
+        Start a cooldown unless one is already running.
+        Returns ``(True, 0)`` if the cooldown was started, or
+        ``(False, seconds_left)`` if the command is still on cooldown.
+        """
+        if duration is None:
+            duration = COOLDOWN_DURATIONS.get(command)
+            if duration is None:
+                raise ValueError(f"No cooldown duration configured for {command!r}")
+
+        self.evict(now)
+        entry = self._entries.get((user_id, command))
+        if entry is not None:
+            timestamp, expires_at = entry
+            if expires_at is None:
+                expires_at = timestamp + duration
+            if expires_at > now:
+                return False, expires_at - now
+
+        self.set(user_id, command, now, now + duration)
+        return True, 0
+
+    def rows(self, now):
+        """Return every active cooldown as ``(user_id, command, timestamp, expires_at)``."""
+        self.evict(now)
+        return [(user_id, command, timestamp, expires_at)
+                for (user_id, command), (timestamp, expires_at) in self._entries.items()]
+
+    def load(self, rows, now):
+        """Replace the contents with ``(user_id, command, timestamp, expires_at)`` rows, skipping expired ones."""
+        self._entries = {}
+        self._users = {}
+        for user_id, command, timestamp, expires_at in rows:
+            if expires_at is not None and expires_at <= now:
+                continue
+            if (user_id, command) not in self._entries:
+                self._users[user_id] = self._users.get(user_id, 0) + 1
+            self._entries[(user_id, command)] = (timestamp, expires_at)
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(expires_at, user_id, command)
+                      for (user_id, command), (_, expires_at) in self._entries.items()
+                      if expires_at is not None]
+        heapq.heapify(self._heap)
@@ -1,186 +1,993 @@
+import asyncio
+import contextlib
+import contextvars
 import json
 import logging
 import os
 import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from config import MAX_HP, MAX_ENERGY
+from config import (
+    MAX_HP, MAX_ENERGY,
+    HP_REGEN_RATE, HP_REGEN_INTERVAL,
+    ENERGY_REGEN_RATE, ENERGY_REGEN_INTERVAL,
+    DB_WRITE_BEHIND, DB_FLUSH_INTERVAL, DB_FLUSH_THRESHOLD, DB_JOURNAL_COMPACT_THRESHOLD,
+    STATS_PATH, STATS_PUBLISH_INTERVAL, DB_VIRTUAL_CACHE_SIZE
+)
+from utils.aggregates import Aggregates
+from utils.cooldowns import CooldownStore, expires_at_for
+from utils.leaderboard import Leaderboard
+from utils.metrics import DB_INIT_BYTES, DB_INIT_SECONDS, DB_SAVE_BYTES, DB_SAVE_ERRORS, DB_SAVE_SECONDS
+from utils.user_locks import UserLockRegistry
+from utils.user_record import UserRecord
 
 logger = logging.getLogger(__name__)
 
+# Version of the on-disk snapshot layout; unversioned snapshots use the old dict-per-user layout
+SNAPSHOT_FORMAT = 3
+
+# Length of a format 2 user tuple, which still carried the user's cooldowns
+FORMAT_2_TUPLE_LENGTH = 9
+
+
+def apply_regen(user, now):
+    """
+    Bring a user's HP and Energy up to date with regeneration.
+
+    Regeneration ticks on a shared wall-clock cycle (every HP_REGEN_INTERVAL /
+    ENERGY_REGEN_INTERVAL seconds), so the number of cycles a user has missed
+    is the difference between the cycle index now and at ``last_regen_at``.
+    Returns True if HP or Energy changed.
+    """
+    last = user.last_regen_at
+    user.last_regen_at = now
+    if last is None or now <= last:
+        return False
+
+    changed = False
+
+    hp_cycles = int(now // HP_REGEN_INTERVAL) - int(last // HP_REGEN_INTERVAL)
+    if hp_cycles > 0 and user.hp < MAX_HP:
+        user.hp = min(user.hp + hp_cycles * HP_REGEN_RATE, MAX_HP)
+        changed = True
+
+    energy_cycles = int(now // ENERGY_REGEN_INTERVAL) - int(last // ENERGY_REGEN_INTERVAL)
+    if energy_cycles > 0 and user.energy < MAX_ENERGY:
+        user.energy = min(user.energy + energy_cycles * ENERGY_REGEN_RATE, MAX_ENERGY)
+        changed = True
+
+    return changed
+
+
+def _legacy_cooldowns(user_id, cooldowns, into):
+    """Convert an old ``{command: timestamp}`` dict into cooldown entries."""
+    for command, timestamp in (cooldowns or {}).items():
+        into[(int(user_id), command)] = (timestamp, expires_at_for(command, timestamp))
+
+
+def _record_from_tuple(user_id, values, cooldowns):
+    """Build a UserRecord from a stored tuple, moving format 2 cooldowns into ``cooldowns``."""
+    if len(values) == FORMAT_2_TUPLE_LENGTH:
+        values = list(values)
+        _legacy_cooldowns(user_id, values.pop(7), cooldowns)
+    return UserRecord.from_tuple(user_id, values)
+
+
+def read_pickle_store(db_path, journal_path):
+    """
+    Load a pickle snapshot and replay its journal on top of it.
+    Returns the users keyed by integer ID, the cooldowns as
+    ``(user_id, command, timestamp, expires_at)`` rows, the role
+    configuration per guild, the snapshot generation and the number of
+    journal records replayed. Replay stops quietly at a torn final record.
+    Snapshots and journals in older layouts are converted on the way in.
+    """
+    users = {}
+    cooldowns = {}  # (user_id, command) -> (timestamp, expires_at)
+    guild_roles = {}
+    generation = 0
+    if db_path.exists():
+        with open(db_path, 'rb') as f:
+            data = pickle.load(f)
+        generation = data.get("generation", 0)
+
+        if data.get("format") in (2, SNAPSHOT_FORMAT):
+            users = {
+                user_id: _record_from_tuple(user_id, values, cooldowns)
+                for user_id, values in data["users"].items()
+            }
+            for user_id, command, timestamp, expires_at in data.get("cooldowns", ()):
+                cooldowns[(user_id, command)] = (timestamp, expires_at)
+            guild_roles = data.get("guild_roles", {})
+        else:
+            for user_id, user in data.get("users", {}).items():
+                record = UserRecord.from_dict(user_id, user, data.get("inventories", {}).get(user_id))
+                users[record.user_id] = record
+                _legacy_cooldowns(user_id, data.get("cooldowns", {}).get(user_id), cooldowns)
+
+    replayed = 0
+    if journal_path.exists():
+        replayed = _replay_journal(journal_path, generation, users, cooldowns, guild_roles)
+
+    cooldown_rows = [(user_id, command, timestamp, expires_at)
+                     for (user_id, command), (timestamp, expires_at) in cooldowns.items()]
+    return users, cooldown_rows, guild_roles, generation, replayed
+
+
+def _replay_journal(journal_path, generation, users, cooldowns, guild_roles):
+    """Apply the journal records to ``users``, ``cooldowns`` and ``guild_roles``. Returns the number replayed."""
+    replayed = 0
+    with open(journal_path, 'rb') as f:
+        try:
+            journal_generation = pickle.load(f)
+        except Exception:
+            journal_generation = None
+
+        # A journal from an older generation is already part of the snapshot
+        if journal_generation != generation:
+            return replayed
+
+        while True:
+            try:
+                entry = pickle.load(f)
+            except EOFError:
+                break
+            except Exception as e:
+                logger.warning(f"Stopped journal replay at a damaged record: {e}")
+                break
+
+            if len(entry) == 5:
+                # ("cooldown", user_id, command, timestamp, expires_at); a None timestamp removes it
+                _, user_id, command, timestamp, expires_at = entry
+                if timestamp is None:
+                    cooldowns.pop((user_id, command), None)
+                else:
+                    cooldowns[(user_id, command)] = (timestamp, expires_at)
+            elif len(entry) == 3:
+                # ("guild", guild_id, roles); an empty roles dict removes the guild
+                _, guild_id, roles = entry
+                if roles:
+                    guild_roles[guild_id] = roles
+                else:
+                    guild_roles.pop(guild_id, None)
+            elif len(entry) == 2:
+                record = _record_from_tuple(*entry, cooldowns)
+                users[record.user_id] = record
+            else:
+                user_id, user, inventory, legacy_cooldowns = entry
+                record = UserRecord.from_dict(user_id, user, inventory)
+                users[record.user_id] = record
+                _legacy_cooldowns(user_id, legacy_cooldowns, cooldowns)
+            replayed += 1
+
+    return replayed
+
+
+class _Transaction:
+    """Changes made inside one ``DatabaseManager.transaction()`` block."""
+
+    def __init__(self):
+        # Copy of each touched user as it was before the transaction; None for new users
+        self.backups = {}
+        self.dirty = set()
+
+        # Cooldown entries as they were before the transaction; None for new ones
+        self.cooldown_backups = {}
+        self.dirty_cooldowns = set()
+
+        # Set when a full snapshot, which includes users created by the transaction, is taken
+        self.snapshotted = False
+
 
 class DatabaseManager:
     """
     Manages persistence of user data and game stats.
-    Uses pickle for data storage between sessions.
+    Uses pickle for data storage between sessions: a snapshot file plus an
+    append-only journal of changed users, which is periodically compacted
+    into a new snapshot.
+
+    In write-behind mode mutations only mark the user dirty; a background
+    flusher persists them every ``flush_interval`` seconds, or sooner once
+    ``flush_threshold`` users are dirty. Call ``close()`` on shutdown so the
+    last changes are written out.
+
+    All disk I/O runs in a single writer thread. A save snapshots the data on
+    the event loop and writes the snapshot in that thread; saves requested
+    while one is running collapse into a single follow-up write.
+
+    Read-modify-write sequences on one user can be serialised with
+    ``async with db.user_lock(user_id):``; the helpers that modify a value
+    based on its current one take that lock themselves.
+
+    Several changes can be grouped with ``async with db.transaction():``.
+    They are persisted together when the block exits, and rolled back in
+    memory if it raises.
+
+    Cooldowns are kept in a CooldownStore keyed by ``(user_id, command)``
+    rather than on the user records, and expired ones are dropped, so only
+    active cooldowns take up memory and disk.
+
+    Reads never write. Looking up a user who isn't stored returns a virtual
+    default record that is only stored and persisted once the user is first
+    changed; the most recent ones are kept in ``_virtual`` so repeated reads
+    return the same object.
+
+    Each guild's role configuration is kept in ``guild_roles`` and written
+    through to disk as soon as it changes.
     """
 
-    def __init__(self):
+    def __init__(self, write_behind=DB_WRITE_BEHIND, flush_interval=DB_FLUSH_INTERVAL,
+                 flush_threshold=DB_FLUSH_THRESHOLD, journal_compact_threshold=DB_JOURNAL_COMPACT_THRESHOLD):
         """Initialize the database manager."""
         self.db_path = Path("rpg_database.pkl")
-        self.data = {
-            "users": {},
-            "cooldowns": {},
-            "inventories": {}
-        }
+        self.clock = time.time
+        self.users = {}
+
+        # Default records of users that have only been read, oldest first
+        self._virtual = {}
+        self.virtual_cache_size = DB_VIRTUAL_CACHE_SIZE
+
+        # Write-behind state
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty = set()
+        self._dirty_cooldowns = set()
+        self._flush_event = None
+        self._flusher = None
+
+        # Writer thread state
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._save_task = None
+        self._save_requested = False
+
+        # Journal state (pickle store only)
+        self.journal_path = Path("rpg_database.journal")
+        self.journal_compact_threshold = journal_compact_threshold
+        self._journal_records = 0
+        self._generation = 0
+        self._force_full = False
+
+        # Running totals over every stored user
+        self.aggregates = Aggregates()
+
+        # EXP ranking of every stored user
+        self.leaderboard = Leaderboard()
+
+        # Aggregate stats published for the dashboard
+        self.stats_path = Path(STATS_PATH)
+        self.stats_interval = STATS_PUBLISH_INTERVAL
+        self._stats_published_at = 0
+
+        # Active cooldowns keyed by (user_id, command)
+        self.cooldowns = CooldownStore()
+
+        # Role configuration per guild: guild_id -> {kind: frozenset of role IDs}
+        self.guild_roles = {}
+
+        # Per-user locks for read-modify-write sequences
+        self.locks = UserLockRegistry()
+
+        # Transaction of the current task, if any
+        self._transaction = contextvars.ContextVar("db_transaction", default=None)
+
+        # Transactions of every task that haven't ended yet
+        self._open_transactions = []
+
+    async def _run_in_writer(self, func, *args):
+        """Run a blocking function in the writer thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
 
     async def initialize(self):
-        """Initialize the database and load existing data if available."""
+        """
+        Initialize the database and load existing data if available.
+        The snapshot is loaded first and the journal is replayed on top of it.
+        """
+        started = time.perf_counter()
+        DB_INIT_BYTES.set(self._stored_bytes())
+
         try:
-            if self.db_path.exists():
-                with open(self.db_path, 'rb') as f:
-                    self.data = pickle.load(f)
-                logger.info(f"Loaded database with {len(self.data['users'])} users")
+            if self.db_path.exists() or self.journal_path.exists():
+                self.users, cooldown_rows, self.guild_roles, replayed = await self._run_in_writer(self._read_file)
+                self.cooldowns.load(cooldown_rows, self.clock())
+                logger.info(f"Loaded database with {len(self.users)} users and "
+                            f"{len(self.cooldowns)} active cooldowns ({replayed} journal records replayed)")
+
+                # Fold the journal into a fresh snapshot so a torn tail never gets appended to
+                if replayed or self.journal_path.exists():
+                    self._force_full = True
+                    await self.save_data()
             else:
                 logger.info("No existing database found. Creating new database.")
+                self._force_full = True
                 await self.save_data()
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
-            # Ensure we have a valid database even if loading fails
+            # Keep the unreadable file for inspection instead of overwriting it
+            if self.db_path.exists():
+                corrupt_path = self.db_path.with_name(f"{self.db_path.name}.corrupt-{int(self.clock())}")
+                self.db_path.rename(corrupt_path)
+                logger.error(f"Moved unreadable database to {corrupt_path}")
+            self._force_full = True
             await self.save_data()
 
+        await self.recount_aggregates()
+        await self.rebuild_leaderboard()
+        DB_INIT_SECONDS.set(time.perf_counter() - started)
+
+    def _stored_bytes(self):
+        """Total size of the database files on disk."""
+        return sum(path.stat().st_size for path in (self.db_path, self.journal_path) if path.exists())
+
+    def _read_file(self):
+        """
+        Load the snapshot and replay the journal. Runs in the writer thread.
+        Returns the users, the cooldown rows, the guild role configuration
+        and the number of journal records replayed.
+        """
+        users, cooldown_rows, guild_roles, self._generation, replayed = read_pickle_store(
+            self.db_path, self.journal_path)
+        return users, cooldown_rows, guild_roles, replayed
+
     async def save_data(self):
-        """Save the current data to disk."""
+        """
+        Save the current data to disk.
+        If a save is already running, this waits for one more save that
+        includes the current changes instead of queueing its own.
+        """
+        self._save_requested = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._run_saves())
+
+        await asyncio.shield(self._save_task)
+
+        # Published outside the save task, which must not finish while a save is requested
+        await self.publish_stats()
+
+    async def _run_saves(self):
+        """Write snapshots until no further save has been requested."""
+        while self._save_requested:
+            self._save_requested = False
+
+            dirty, dirty_cooldowns = self._dirty, self._dirty_cooldowns
+            self._dirty, self._dirty_cooldowns = set(), set()
+
+            started = time.perf_counter()
+            try:
+                snapshot = self._snapshot(dirty, dirty_cooldowns)
+                written = await self._run_in_writer(self._write_snapshot, snapshot)
+                DB_SAVE_SECONDS.observe(time.perf_counter() - started)
+                if written:
+                    DB_SAVE_BYTES.inc(written)
+                logger.debug("Database saved successfully")
+            except Exception as e:
+                DB_SAVE_ERRORS.inc()
+                logger.error(f"Error saving database: {e}")
+                self._dirty |= dirty
+                self._dirty_cooldowns |= dirty_cooldowns
+
+    def _before_change(self, user):
+        """
+        Take a user out of the running totals before changing them.
+        A virtual record is stored first, since this is its first change.
+        """
+        if self.users.get(user.user_id) is not user:
+            self._materialise(user)
+        self.aggregates.remove(user)
+
+    def _after_change(self, user):
+        """Put a user back into the running totals and the leaderboard after changing them."""
+        self.aggregates.add(user)
+        self.leaderboard.update(user.user_id, user.exp)
+
+    async def recount_aggregates(self):
+        """
+        Rebuild the running totals from scratch.
+        Done at startup and by the periodic compaction pass, which also
+        corrects any drift from records modified in place without going
+        through DatabaseManager.
+        """
+        aggregates = Aggregates()
+        for user in self.users.values():
+            aggregates.add(user)
+        self.aggregates = aggregates
+
+    async def rebuild_leaderboard(self):
+        """Rebuild the EXP leaderboard from every stored user."""
+        self.leaderboard.rebuild((user_id, user.exp) for user_id, user in self.users.items())
+
+    def get_aggregates(self):
+        """
+        Return the running totals: user count, coins in circulation,
+        total quantity per item, level histogram and users with active cooldowns.
+        """
+        aggregates = self.aggregates.as_dict()
+        aggregates["cooldown_users"] = self.cooldowns.user_count()
+        return aggregates
+
+    def get_stats(self):
+        """Return the small aggregate shown on the dashboard."""
+        return {
+            "users": self.aggregates.users,
+            "items": sum(self.aggregates.items.values()),
+            "commands_used": self.cooldowns.user_count()
+        }
+
+    async def publish_stats(self, force=False):
+        """
+        Publish ``get_stats()`` to ``stats_path`` for the dashboard.
+        Publishing is throttled to once every ``stats_interval`` seconds unless forced.
+        """
+        now = self.clock()
+        if not force and now - self._stats_published_at < self.stats_interval:
+            return
+        self._stats_published_at = now
+
         try:
-            with open(self.db_path, 'wb') as f:
-                pickle.dump(self.data, f)
-            logger.debug("Database saved successfully")
+            await self._run_in_writer(self._write_stats, self.get_stats())
         except Exception as e:
-            logger.error(f"Error saving database: {e}")
+            logger.error(f"Error publishing stats: {e}")
 
-    async def get_user(self, user_id):
+    def _write_stats(self, stats):
+        """Atomically replace the stats file. Runs in the writer thread."""
+        stats["updated_at"] = time.time()
+
+        tmp_path = self.stats_path.with_name(self.stats_path.name + ".tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, self.stats_path)
+
+    def _snapshot(self, dirty, dirty_cooldowns):
         """
-        Get a user's data from the database.
-        If the user doesn't exist, create a new entry.
+        Take a consistent copy of the data to write.
+        Runs on the event loop, so nothing can change while it is taken.
+
+        Usually this is just one journal record per dirty user or cooldown;
+        once the journal holds ``journal_compact_threshold`` records a full
+        snapshot is taken instead so the journal can be compacted. Full
+        snapshots only contain cooldowns that are still active.
         """
-        user_id = str(user_id)  # Ensure user_id is a string
+        changes = len(dirty) + len(dirty_cooldowns)
+        if not self._force_full and self._journal_records + changes < self.journal_compact_threshold:
+            self._journal_records += changes
+            records = [(user_id, self.users[user_id].to_tuple()) for user_id in dirty]
+            for user_id, command in dirty_cooldowns:
+                timestamp, expires_at = self.cooldowns.entry(user_id, command) or (None, None)
+                records.append(("cooldown", user_id, command, timestamp, expires_at))
+            return "journal", records
+
+        self._force_full = False
+        self._journal_records = 0
+        for transaction in self._open_transactions:
+            transaction.snapshotted = True
+        return "full", {
+            "format": SNAPSHOT_FORMAT,
+            "users": {user_id: user.to_tuple() for user_id, user in self.users.items()},
+            "cooldowns": self.cooldowns.rows(self.clock()),
+            "guild_roles": {guild_id: dict(roles) for guild_id, roles in self.guild_roles.items()}
+        }
 
-        if user_id not in self.data["users"]:
-            # Create new user with default values
-            self.data["users"][user_id] = {
-                "hp": MAX_HP,
-                "energy": MAX_ENERGY,
-                "exp": 0,
-                "level": 1
-            }
+    def _write_snapshot(self, snapshot):
+        """Write a snapshot to disk and return the bytes written. Runs in the writer thread."""
+        kind, payload = snapshot
+        try:
+            if kind == "journal":
+                return self._append_journal(payload)
+            else:
+                return self._write_full(payload)
+        except Exception:
+            # The journal may now end in a torn record, so start over from a full snapshot
+            self._force_full = True
+            raise
+
+    def _append_journal(self, records):
+        """Append journal records and sync them to disk. Returns the bytes written."""
+        if not records:
+            return 0
 
-            # Create empty inventory for the user
-            self.data["inventories"][user_id] = {}
+        new_journal = not self.journal_path.exists()
+        with open(self.journal_path, 'ab') as f:
+            start = f.seek(0, os.SEEK_END)
+            if new_journal:
+                pickle.dump(self._generation, f)
+            for record in records:
+                pickle.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell() - start
+
+    def _write_full(self, data):
+        """
+        Atomically replace the snapshot, then start an empty journal.
+        A crash at any point leaves either the old or the new snapshot intact.
+        Returns the bytes written.
+        """
+        generation = self._generation + 1
+        data["generation"] = generation
+
+        tmp_path = self.db_path.with_name(self.db_path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+            written = f.tell()
+        os.replace(tmp_path, self.db_path)
+        self._generation = generation
+
+        tmp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(generation, f)
+            f.flush()
+            os.fsync(f.fileno())
+            written += f.tell()
+        os.replace(tmp_path, self.journal_path)
+        return written
+
+    def start_flusher(self):
+        """Start the background write-behind flusher."""
+        if not self.write_behind or self._flusher is not None:
+            return
+
+        self._flush_event = asyncio.Event()
+        self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        logger.info(f"Write-behind flusher started (interval {self.flush_interval}s, "
+                    f"threshold {self.flush_threshold} users)")
+
+    async def _flush_loop(self):
+        """Persist dirty users on an interval or when the threshold is reached."""
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._flush_event.clear()
+            await self.flush()
+
+    async def _mark_dirty(self, *user_ids, cooldowns=()):
+        """
+        Record that users or ``(user_id, command)`` cooldowns changed and
+        persist them according to the write mode.
+        """
+        transaction = self._transaction.get()
+        if transaction is not None:
+            # Persisted once when the transaction commits
+            transaction.dirty.update(user_ids)
+            transaction.dirty_cooldowns.update(cooldowns)
+            return
 
-            # Create cooldowns entry for the user
-            self.data["cooldowns"][user_id] = {}
+        self._dirty.update(user_ids)
+        self._dirty_cooldowns.update(cooldowns)
 
+        if not self.write_behind or self._flusher is None:
             await self.save_data()
+        elif len(self._dirty) + len(self._dirty_cooldowns) >= self.flush_threshold:
+            self._flush_event.set()
+
+    def user_lock(self, user_id):
+        """
+        Lock a user for a read-modify-write sequence.
+
+        Usage: async with db.user_lock(user_id): ...
+        """
+        return self.locks.lock(int(user_id))
+
+    @contextlib.asynccontextmanager
+    async def user_locks(self, user_ids):
+        """
+        Lock several users for a batched read-modify-write sequence.
+        Locks are taken in ascending ID order so two batches can't deadlock.
+
+        Usage: async with db.user_locks(user_ids): ...
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for user_id in sorted({int(user_id) for user_id in user_ids}):
+                await stack.enter_async_context(self.user_lock(user_id))
+            yield
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """
+        Group several changes into one persistence point.
+
+        Changes made by the current task inside the block are saved together
+        when it exits. If the block raises, every user it touched is restored
+        to its state before the block. Nested blocks join the outer one.
+        """
+        if self._transaction.get() is not None:
+            yield
+            return
+
+        transaction = _Transaction()
+        token = self._transaction.set(transaction)
+        self._open_transactions.append(transaction)
+        try:
+            yield
+        except BaseException:
+            self._rollback(transaction)
+            raise
+        finally:
+            self._transaction.reset(token)
+            self._open_transactions.remove(transaction)
+
+        if transaction.dirty or transaction.dirty_cooldowns:
+            await self._mark_dirty(*transaction.dirty, cooldowns=transaction.dirty_cooldowns)
+
+    def _rollback(self, transaction):
+        """
+        Undo the in-memory changes of a failed transaction.
+        A save taken while the transaction was open may have written its
+        changes, so the restored users and cooldowns are marked dirty again,
+        and a full snapshot that included users it created is replaced.
+        """
+        for user_id, backup in transaction.backups.items():
+            user = self.users.get(user_id)
+            if user is None:
+                continue
+
+            self._before_change(user)
+            if backup is None:
+                del self.users[user_id]
+                self.leaderboard.remove(user_id)
+                self._dirty.discard(user_id)
+                if transaction.snapshotted:
+                    self._force_full = True
+            else:
+                user.restore(backup)
+                self._after_change(user)
+                self._dirty.add(user_id)
+
+        for (user_id, command), entry in transaction.cooldown_backups.items():
+            if entry is None:
+                self.cooldowns.discard(user_id, command)
+            else:
+                self.cooldowns.set(user_id, command, *entry)
+            self._dirty_cooldowns.add((user_id, command))
+
+        logger.debug(f"Rolled back transaction touching {len(transaction.backups)} users "
+                     f"and {len(transaction.cooldown_backups)} cooldowns")
+
+    def _pinned_users(self):
+        """
+        Return the IDs of users that backends loading users on demand must
+        keep in memory: dirty, locked, or touched by an open transaction.
+        """
+        pinned = set(self._dirty)
+        pinned.update(self.locks)
+        for transaction in self._open_transactions:
+            pinned.update(transaction.backups)
+        return pinned
+
+    def _save_running(self):
+        """True while a save is in progress. A failed save marks its users dirty again."""
+        return self._save_task is not None and not self._save_task.done()
+
+    def get_guild_roles(self, guild_id):
+        """Return a guild's role configuration as ``{kind: frozenset of role IDs}``."""
+        return self.guild_roles.get(int(guild_id), {})
+
+    async def set_guild_roles(self, guild_id, kind, role_ids):
+        """
+        Replace one kind of role (e.g. ``"moderator"``) in a guild's configuration.
+        The change is written to disk before this returns, and undone in
+        memory if the write fails.
+        """
+        guild_id = int(guild_id)
+        previous = self.guild_roles.get(guild_id)
+
+        roles = dict(previous or {})
+        roles[kind] = frozenset(int(role_id) for role_id in role_ids)
+        if not roles[kind]:
+            del roles[kind]
 
-        return self.data["users"][user_id]
+        # Update memory first so a snapshot taken meanwhile already includes the change
+        if roles:
+            self.guild_roles[guild_id] = roles
+        else:
+            self.guild_roles.pop(guild_id, None)
+
+        try:
+            await self._write_guild_roles(guild_id, roles)
+        except Exception as e:
+            logger.error(f"Error saving role configuration for guild {guild_id}: {e}")
+            if previous is None:
+                self.guild_roles.pop(guild_id, None)
+            else:
+                self.guild_roles[guild_id] = previous
+            raise
+
+    async def _write_guild_roles(self, guild_id, roles):
+        """Persist a guild's role configuration as a journal record."""
+        self._journal_records += 1
+        await self._run_in_writer(self._write_snapshot, ("journal", [("guild", guild_id, roles)]))
+
+    async def flush(self):
+        """Write out any pending changes."""
+        if not self._dirty and not self._dirty_cooldowns:
+            return
+
+        count, cooldown_count = len(self._dirty), len(self._dirty_cooldowns)
+        await self.save_data()
+        logger.debug(f"Flushed {count} dirty users and {cooldown_count} cooldowns")
+
+    async def close(self):
+        """Stop the flusher and make sure every pending change is on disk."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+
+        await self.flush()
+        await self.publish_stats(force=True)
+        self._executor.shutdown(wait=True)
+
+    async def _load_user(self, user_id):
+        """
+        Bring a stored user into ``self.users``.
+        The pickle store keeps every user in memory, so there is nothing to load.
+        Returns True if the user was found.
+        """
+        return False
+
+    async def _load_all_users(self):
+        """Bring every stored user into ``self.users``."""
+        pass
+
+    async def _get_record(self, user_id):
+        """
+        Return the UserRecord for a user.
+        HP and Energy regeneration is applied lazily on every lookup.
+
+        A user who isn't stored gets a virtual default record; it is stored
+        by ``_before_change`` when the user is first changed.
+        """
+        user_id = int(user_id)
+        user = self.users.get(user_id)
+
+        if user is None and user_id not in self._virtual:
+            await self._load_user(user_id)
+            # Another command may have stored the user while we were waiting
+            user = self.users.get(user_id)
+
+        if user is None:
+            user = self._virtual.pop(user_id, None)
+            if user is None:
+                user = UserRecord(user_id, last_regen_at=self.clock())
+            else:
+                apply_regen(user, self.clock())
+
+            self._remember_virtual(user)
+            return user
+
+        apply_regen(user, self.clock())
+        transaction = self._transaction.get()
+        if transaction is not None and user_id not in transaction.backups:
+            transaction.backups[user_id] = user.copy()
+        return user
+
+    def _remember_virtual(self, user):
+        """Keep a virtual record for repeated reads, dropping the oldest one when full."""
+        if len(self._virtual) >= self.virtual_cache_size:
+            del self._virtual[next(iter(self._virtual))]
+        self._virtual[user.user_id] = user
+
+    def _materialise(self, user):
+        """Store a virtual record. The change that triggered it marks it dirty."""
+        self._virtual.pop(user.user_id, None)
+        self.users[user.user_id] = user
+        self._after_change(user)
+
+        transaction = self._transaction.get()
+        if transaction is not None:
+            transaction.backups.setdefault(user.user_id, None)
+
+    async def get_user(self, user_id):
+        """
+        Get a user's data from the database.
+        A user who doesn't exist yet gets default values without being stored.
+        The returned UserRecord can be used like the old per-user dict; change
+        it through the update methods so the change is persisted.
+        """
+        return await self._get_record(user_id)
+
+    async def get_users(self, user_ids):
+        """Get several users' data, in the order given. See get_user."""
+        return [await self._get_record(user_id) for user_id in user_ids]
 
     async def get_all_users(self):
-        """Get all users' data."""
-        return self.data["users"]
+        """Get all users' data keyed by integer ID, with regeneration applied."""
+        await self._load_all_users()
+
+        now = self.clock()
+        for user in self.users.values():
+            apply_regen(user, now)
+        return self.users
+
+    async def settle_regen(self):
+        """
+        Fold pending regeneration into every stored user and persist once.
+        Regeneration is computed on read, so this is only a compaction pass
+        that keeps the saved HP/Energy values from drifting too far behind.
+        """
+        now = self.clock()
+        changed = [user_id for user_id, user in self.users.items() if apply_regen(user, now)]
+
+        if changed:
+            await self._mark_dirty(*changed)
+
+        return len(changed)
 
     async def update_user_stat(self, user_id, stat, value):
         """Update a specific stat for a user."""
-        user_id = str(user_id)
-
-        # Get the user (or create if doesn't exist)
-        user = await self.get_user(user_id)
+        # Get the user (a default record if they don't exist yet)
+        user = await self._get_record(user_id)
 
         # Update the stat
+        self._before_change(user)
         user[stat] = value
-        await self.save_data()
+        self._after_change(user)
+        await self._mark_dirty(user.user_id)
 
         return user
 
-    async def get_inventory(self, user_id):
-        """Get a user's inventory."""
-        user_id = str(user_id)
+    async def update_user_stats(self, user_id, **fields):
+        """
+        Update several stats for a user at once.
+        The changes are persisted together.
 
-        # Ensure user exists
-        await self.get_user(user_id)
+        Usage: await db.update_user_stats(user_id, hp=MAX_HP, energy=MAX_ENERGY)
+        """
+        user = await self._get_record(user_id)
 
-        if user_id not in self.data["inventories"]:
-            self.data["inventories"][user_id] = {}
-            await self.save_data()
+        self._before_change(user)
+        for stat, value in fields.items():
+            user[stat] = value
+        self._after_change(user)
 
-        return self.data["inventories"][user_id]
+        await self._mark_dirty(user.user_id)
+        return user
+
+    async def update_many_stats(self, updates):
+        """
+        Update stats for many users in one batch.
+        ``updates`` maps user IDs to ``{stat: value}`` dicts. The changes are
+        persisted together, and rolled back together if any of them fails.
+        """
+        async with self.transaction():
+            for user_id, fields in updates.items():
+                await self.update_user_stats(user_id, **fields)
+
+    async def increment_stat(self, user_id, stat, delta, minimum=None, maximum=None):
+        """
+        Atomically add ``delta`` to a stat and return the new value.
+        The result is clamped to ``minimum``/``maximum`` when given.
+        """
+        async with self.user_lock(user_id):
+            user = await self._get_record(user_id)
+
+            value = user.get(stat, 0) + delta
+            if minimum is not None:
+                value = max(value, minimum)
+            if maximum is not None:
+                value = min(value, maximum)
+
+            self._before_change(user)
+            user[stat] = value
+            self._after_change(user)
+            await self._mark_dirty(user.user_id)
+            return value
+
+    async def get_inventory(self, user_id):
+        """Get a user's inventory."""
+        user = await self._get_record(user_id)
+        return user.get_inventory()
 
     async def add_item_to_inventory(self, user_id, item_id, quantity=1):
         """Add an item to a user's inventory."""
-        user_id = str(user_id)
-        inventory = await self.get_inventory(user_id)
+        async with self.user_lock(user_id):
+            user = await self._get_record(user_id)
+            inventory = user.get_inventory()
 
-        if item_id in inventory:
-            inventory[item_id] += quantity
-        else:
-            inventory[item_id] = quantity
+            self._before_change(user)
+            if item_id in inventory:
+                inventory[item_id] += quantity
+            else:
+                inventory[item_id] = quantity
+            self._after_change(user)
 
-        await self.save_data()
-        return inventory
+            await self._mark_dirty(user.user_id)
+            return inventory
 
     async def remove_item_from_inventory(self, user_id, item_id, quantity=1):
         """Remove an item from a user's inventory."""
-        user_id = str(user_id)
-        inventory = await self.get_inventory(user_id)
+        async with self.user_lock(user_id):
+            user = await self._get_record(user_id)
+            inventory = user.get_inventory()
 
-        if item_id not in inventory or inventory[item_id] < quantity:
-            return False
+            if item_id not in inventory or inventory[item_id] < quantity:
+                return False
 
-        inventory[item_id] -= quantity
-
-        if inventory[item_id] <= 0:
-            del inventory[item_id]
-
-        await self.save_data()
-        return True
+            self._before_change(user)
+            inventory[item_id] -= quantity
 
-    async def set_cooldown(self, user_id, command, timestamp):
-        """Set a cooldown for a specific command for a user."""
-        user_id = str(user_id)
+            if inventory[item_id] <= 0:
+                del inventory[item_id]
+            self._after_change(user)
 
-        # Ensure user exists
-        await self.get_user(user_id)
+            await self._mark_dirty(user.user_id)
+            return True
 
-        if user_id not in self.data["cooldowns"]:
-            self.data["cooldowns"][user_id] = {}
+    def _backup_cooldown(self, user_id, command):
+        """Remember a cooldown's current entry so the running transaction can roll it back."""
+        transaction = self._transaction.get()
+        if transaction is not None and (user_id, command) not in transaction.cooldown_backups:
+            transaction.cooldown_backups[(user_id, command)] = self.cooldowns.entry(user_id, command)
 
-        self.data["cooldowns"][user_id][command] = timestamp
-        await self.save_data()
+    async def set_cooldown(self, user_id, command, timestamp, duration=None):
+        """
+        Set a cooldown for a specific command for a user.
+        It expires after ``duration`` seconds, or the command's entry in
+        COOLDOWN_DURATIONS when no duration is given.
+        """
+        user_id = int(user_id)
+        self._backup_cooldown(user_id, command)
+        self.cooldowns.set(user_id, command, timestamp, expires_at_for(command, timestamp, duration))
+        await self._mark_dirty(cooldowns=[(user_id, command)])
 
     async def get_cooldown(self, user_id, command):
-        """Get the cooldown timestamp for a specific command for a user."""
-        user_id = str(user_id)
-
-        # Ensure user exists
-        await self.get_user(user_id)
+        """
+        Get the cooldown timestamp for a specific command for a user.
+        Returns 0 if the command isn't on cooldown (or the cooldown has expired).
+        """
+        return self.cooldowns.get(int(user_id), command, self.clock())
 
-        if user_id not in self.data["cooldowns"] or command not in self.data["cooldowns"][user_id]:
-            return 0
+    async def check_and_set(self, user_id, command, duration=None):
+        """
+        Start a command's cooldown unless it is already running.
+        The check and the update happen without yielding to the event loop,
+        so two invocations can never both pass.
 
-        return self.data["cooldowns"][user_id][command]
+        Returns ``(True, 0)`` if the command may run, or ``(False, seconds_left)``.
+        """
+        user_id = int(user_id)
+        self._backup_cooldown(user_id, command)
+        allowed, retry_after = self.cooldowns.check_and_set(user_id, command, self.clock(), duration)
+        if allowed:
+            await self._mark_dirty(cooldowns=[(user_id, command)])
+        return allowed, retry_after
 
     async def add_coins(self, user_id, amount):
         """Add gacha coins to a user's account."""
-        user_id = str(user_id)
-        user = await self.get_user(user_id)
+        async with self.user_lock(user_id):
+            user = await self._get_record(user_id)
 
-        if "coins" not in user:
-            user["coins"] = 0
+            self._before_change(user)
+            if user.coins is None:
+                user.coins = 0
 
-        user["coins"] += amount
-        await self.save_data()
-        return user["coins"]
+            user.coins += amount
+            self._after_change(user)
+            await self._mark_dirty(user.user_id)
+            return user.coins
 
     async def remove_coins(self, user_id, amount):
         """Remove gacha coins from a user's account."""
-        user_id = str(user_id)
-        user = await self.get_user(user_id)
+        async with self.user_lock(user_id):
+            user = await self._get_record(user_id)
 
-        if "coins" not in user:
-            return False
+            if user.coins is None:
+                return False
 
-        if user["coins"] < amount:
-            return False
+            if user.coins < amount:
+                return False
 
-        user["coins"] -= amount
-        await self.save_data()
-        return user["coins"]
+            self._before_change(user)
+            user.coins -= amount
+            self._after_change(user)
+            await self._mark_dirty(user.user_id)
+            return user.coins
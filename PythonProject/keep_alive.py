@@ -1,3 +1,12 @@
+"""
+Standalone Flask keep-alive server.
+
+The bot serves these routes itself from its event loop (see web_server.py),
+so this is only needed to run the endpoints without the bot. /metrics is
+left out: metrics are collected in the bot's process, so a separate server
+would only report an empty set.
+"""
+
 import os
 import time
 import requests
@@ -0,0 +1,72 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """
+    EXP ranking of every stored user.
+
+    Entries are kept sorted as ``(-exp, user_id)`` keys, so the best player
+    comes first and ties are broken by user ID. Rank lookups are a binary
+    search; an update is a binary search plus a list insert/delete, which is
+    a single memmove even for hundreds of thousands of users.
+
+    Rows are returned as ``(rank, user_id, exp)`` tuples with 1-based ranks.
+    """
+
+    def __init__(self):
+        self._keys = []
+        self._exp = {}
+
+    def __len__(self):
+        return len(self._exp)
+
+    def _index(self, user_id):
+        """Position of a user in ``_keys``, or None if they aren't ranked."""
+        exp = self._exp.get(user_id)
+        if exp is None:
+            return None
+        return bisect_left(self._keys, (-exp, user_id))
+
+    def _rows(self, start, stop):
+        return [(start + offset + 1, user_id, -neg_exp)
+                for offset, (neg_exp, user_id) in enumerate(self._keys[start:stop])]
+
+    def rebuild(self, entries):
+        """Replace the index with ``(user_id, exp)`` pairs."""
+        self._exp = dict(entries)
+        self._keys = sorted((-exp, user_id) for user_id, exp in self._exp.items())
+
+    def update(self, user_id, exp):
+        """Insert a user or move them to their new EXP."""
+        old_exp = self._exp.get(user_id)
+        if old_exp == exp:
+            return
+
+        if old_exp is not None:
+            del self._keys[self._index(user_id)]
+
+        self._exp[user_id] = exp
+        insort(self._keys, (-exp, user_id))
+
+    def remove(self, user_id):
+        """Drop a user from the ranking."""
+        index = self._index(user_id)
+        if index is not None:
+            del self._keys[index]
+            del self._exp[user_id]
+
+    def top_n(self, n):
+        """Return the ``n`` best players."""
+        return self._rows(0, max(n, 0))
+
+    def rank_of(self, user_id):
+        """Return a user's 1-based rank, or None if they aren't ranked."""
+        index = self._index(user_id)
+        return None if index is None else index + 1
+
+    def neighbors(self, user_id, k):
+        """Return up to ``k`` players either side of a user, including the user."""
+        index = self._index(user_id)
+        if index is None:
+            return []
+        return self._rows(max(index - k, 0), index + k + 1)
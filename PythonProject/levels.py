@@ -0,0 +1,58 @@
+"""
+Level lookups compiled from LEVEL_THRESHOLDS.
+
+The sparse ``{level: exp}`` table in config.py is turned into two parallel
+sorted lists once at import, so every lookup is a single binary search.
+"""
+
+from bisect import bisect_right
+
+from config import LEVEL_THRESHOLDS
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; batch lookups fall back to plain Python
+    np = None
+
+LEVELS = tuple(sorted(LEVEL_THRESHOLDS))
+THRESHOLDS = tuple(LEVEL_THRESHOLDS[level] for level in LEVELS)
+
+if THRESHOLDS[0] != 0:
+    raise ValueError("LEVEL_THRESHOLDS must start at 0 EXP")
+if any(low >= high for low, high in zip(THRESHOLDS, THRESHOLDS[1:])):
+    raise ValueError("LEVEL_THRESHOLDS must increase with the level")
+
+_NP_LEVELS = np.array(LEVELS) if np is not None else None
+_NP_THRESHOLDS = np.array(THRESHOLDS) if np is not None else None
+
+
+def _index(exp):
+    """Index into LEVELS of the level reached with ``exp``."""
+    return max(bisect_right(THRESHOLDS, exp) - 1, 0)
+
+
+def level_for(exp):
+    """Return the level reached with ``exp`` EXP."""
+    return LEVELS[_index(exp)]
+
+
+def levels_for(exps):
+    """
+    Return the level for every EXP value in ``exps``.
+    NumPy arrays are looked up in one vectorised call and give an array back.
+    """
+    if np is not None and isinstance(exps, np.ndarray):
+        indexes = np.searchsorted(_NP_THRESHOLDS, exps, side="right") - 1
+        return _NP_LEVELS[np.maximum(indexes, 0)]
+
+    return [LEVELS[_index(exp)] for exp in exps]
+
+
+def level_change(old_exp, new_exp):
+    """
+    Return ``(new_level, crossed)`` for an EXP change, where ``crossed`` lists
+    every level reached on the way up (empty if the level didn't change).
+    """
+    old_index = _index(old_exp)
+    new_index = _index(new_exp)
+    return LEVELS[new_index], list(LEVELS[old_index + 1:new_index + 1])
@@ -1,43 +1,67 @@
+import asyncio
+import logging
+import os
+import signal
+
+from dotenv import load_dotenv
 
 from bot import setup_bot
-from keep_alive import keep_alive
-from uptime import setup_uptime_helper
+from uptime import register_with_uptime_services
+
 # Load environment variables from .env file
 load_dotenv()
-logger.error(f"Error loading stats: {e}")
-return jsonify({'error': 'Failed to load stats'}), 500
-@app.route('/status')
-def status():
-    """Status endpoint for monitoring services."""
-    return jsonify({
-        'status': 'online',
-        'bot': 'STATBOT',
-        'version': '1.0.0'
-    })
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
 async def main():
     """
     Main entry point for the Discord RPG bot.
+    The bot, its web server and the self-ping all run on this one event loop.
     """
-    try:
-        bot = await setup_bot()
-        bot_token = os.getenv("DISCORD_BOT_TOKEN")
-        if not bot_token:
-            logger.error("No Discord bot token found in environment variables. Please set DISCORD_BOT_TOKEN.")
-            return
+    bot_token = os.getenv("DISCORD_BOT_TOKEN")
+    if not bot_token:
+        logger.error("No Discord bot token found in environment variables. Please set DISCORD_BOT_TOKEN.")
+        return
 
-        # Log successful connection
+    bot = await setup_bot()
+
+    # Close the bot on SIGTERM (how containers and Replit stop it) and SIGINT,
+    # so pending write-behind changes are flushed before the process exits
+    shutdown = []
+
+    def request_shutdown(sig):
+        if not shutdown:
+            logger.info(f"Received {sig.name}, shutting down")
+            shutdown.append(asyncio.create_task(bot.close()))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig)
+        except NotImplementedError:
+            # Not available on Windows; Ctrl+C still cancels main() and closes the bot below
+            pass
+
+    try:
         logger.info("Starting Discord bot with token...")
         await bot.start(bot_token)
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
-        if __name__ == "__main__":
-            # Start the keep-alive web server in a separate thread
-            keep_alive()
-            # Run the bot
+    finally:
+        if shutdown:
+            await shutdown[0]
+        elif not bot.is_closed():
+            await bot.close()
+
 
-            # Setup the uptime helper for 24/7 operation
-            setup_uptime_helper()
+if __name__ == "__main__":
+    # Print the uptime monitoring instructions
+    register_with_uptime_services()
 
-            # Run the Discord bot
-            logger.info("Starting Discord RPG Bot - Mortem House Stat")
-            asyncio.run(main())
+    logger.info("Starting Discord RPG Bot - Mortem House Stat")
+    asyncio.run(main())
@@ -0,0 +1,165 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Metrics are plain objects updated without locks. ``/metrics`` is served by
+``web_server.WebServer`` on the bot's event loop, and every metric is
+written on that loop too; the save/load metrics are recorded there from the
+figures the database writer thread returns. So a render never runs in the
+middle of an update.
+
+Metrics are created once at import below and updated from the hot paths.
+``render()`` returns the text exposition of all of them.
+"""
+
+from bisect import bisect_left
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    """Monotonically increasing value."""
+
+    kind = "counter"
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.value}"
+
+
+class Gauge:
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name, labels):
+        yield f"{name}{_format_labels(labels)} {self.value}"
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets."""
+
+    kind = "histogram"
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot counts values above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}"
+        yield f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {self.count}"
+        yield f"{name}_sum{_format_labels(labels)} {self.sum}"
+        yield f"{name}_count{_format_labels(labels)} {self.count}"
+
+
+class Metric:
+    """
+    A named metric, optionally split by one label.
+    Without a label the metric is used directly through ``inc``, ``set`` or
+    ``observe``; with one, ``labels(value)`` returns the metric for that value.
+    """
+
+    def __init__(self, name, help_text, factory, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.factory = factory
+        self.label = label
+        self._children = {}
+        self._metric = None if label else factory()
+        _registry.append(self)
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            child = self._children[value] = self.factory()
+        return child
+
+    def inc(self, amount=1):
+        self._metric.inc(amount)
+
+    def set(self, value):
+        self._metric.set(value)
+
+    def observe(self, value):
+        self._metric.observe(value)
+
+    def render(self):
+        kind = self._metric.kind if self._metric is not None else self.factory().kind
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {kind}"]
+        if self._metric is not None:
+            lines.extend(self._metric.samples(self.name, ()))
+        else:
+            for value, child in list(self._children.items()):
+                lines.extend(child.samples(self.name, ((self.label, value),)))
+        return lines
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Commands
+COMMAND_LATENCY = Metric("statbot_command_latency_seconds", "Time spent running a command.",
+                         Histogram, label="command")
+COMMAND_ERRORS = Metric("statbot_command_errors_total", "Commands that ended in an error.",
+                        Counter, label="command")
+
+# Database
+DB_SAVE_SECONDS = Metric("statbot_db_save_seconds", "Time taken by a database save, including queueing.",
+                         Histogram)
+DB_SAVE_BYTES = Metric("statbot_db_save_bytes_total", "Bytes written by database saves (not counted for SQLite).",
+                       Counter)
+DB_SAVE_ERRORS = Metric("statbot_db_save_errors_total", "Database saves that failed.", Counter)
+DB_INIT_SECONDS = Metric("statbot_db_init_seconds", "Time taken to load the database at startup.", Gauge)
+DB_INIT_BYTES = Metric("statbot_db_init_bytes", "Size of the database files loaded at startup.", Gauge)
+DB_CACHE_HITS = Metric("statbot_db_cache_hits_total", "User lookups answered from memory (SQLite store only).",
+                       Counter)
+DB_CACHE_MISSES = Metric("statbot_db_cache_misses_total",
+                         "User lookups that read from the database (SQLite store only).", Counter)
+DB_CACHE_EVICTIONS = Metric("statbot_db_cache_evictions_total", "Users dropped from memory (SQLite store only).",
+                            Counter)
+
+# Background work
+REGEN_SECONDS = Metric("statbot_regen_cycle_seconds", "Time taken by a regeneration compaction pass.",
+                       Histogram)
+LOOP_LAG_SECONDS = Metric("statbot_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.",
+                          Histogram)
@@ -0,0 +1,91 @@
+# Permission tier bits; a member's tier is any combination of these
+AUTHORIZED = 1  # May use the Admin cog at all
+HEALER = 2  # May use heal
+MODERATOR = 4  # May grant EXP
+
+# Members whose tier is cached before the oldest entries are dropped
+TIER_CACHE_SIZE = 10000
+
+
+class PermissionResolver:
+    """
+    Resolves a member's permission tier for the Admin cog.
+
+    Each guild's authorized, moderator and healer role IDs are kept as
+    frozensets, and each member's tier is worked out in one pass over their
+    roles and then cached by ``(guild_id, member_id)``. A check is a dict
+    lookup and a bit test until the member's roles or the guild's role
+    configuration change, which drops the affected cache entries.
+
+    Guilds that haven't configured a healer role use ``default_healer_role_id``.
+    """
+
+    def __init__(self, guild_roles=None, default_healer_role_id=None, cache_size=TIER_CACHE_SIZE):
+        self.default_healer_role_id = default_healer_role_id
+        self.cache_size = cache_size
+        self._roles = {}  # guild_id -> (authorized, moderator, healer) frozensets
+        self._tiers = {}  # (guild_id, member_id) -> tier bits, oldest first
+        self._default_roles = self._index({})
+
+        for guild_id, roles in (guild_roles or {}).items():
+            self._roles[guild_id] = self._index(roles)
+
+    def _index(self, roles):
+        """Turn a ``{kind: role IDs}`` configuration into the tuple used by ``_resolve``."""
+        healer = roles.get("healer")
+        if not healer and self.default_healer_role_id is not None:
+            healer = {self.default_healer_role_id}
+        return (
+            frozenset(roles.get("authorized", ())),
+            frozenset(roles.get("moderator", ())),
+            frozenset(healer or ())
+        )
+
+    def set_roles(self, guild_id, roles):
+        """Replace a guild's ``{kind: role IDs}`` configuration."""
+        self._roles[guild_id] = self._index(roles)
+        self.invalidate_guild(guild_id)
+
+    def tier(self, member):
+        """Return the tier bits of a guild member."""
+        key = (member.guild.id, member.id)
+        tier = self._tiers.get(key)
+        if tier is None:
+            tier = self._resolve(member)
+            if len(self._tiers) >= self.cache_size:
+                del self._tiers[next(iter(self._tiers))]
+            self._tiers[key] = tier
+        return tier
+
+    def has(self, member, tier):
+        """Return True if a member has every bit in ``tier``."""
+        return self.tier(member) & tier == tier
+
+    def _resolve(self, member):
+        """Work out a member's tier from their roles."""
+        authorized, moderator, healer = self._roles.get(member.guild.id, self._default_roles)
+
+        tier = 0
+        for role in member.roles:
+            if role.id in authorized:
+                tier |= AUTHORIZED
+            if role.id in healer:
+                tier |= HEALER
+            if role.id in moderator or role.permissions.administrator or role.permissions.manage_guild:
+                tier |= MODERATOR
+        return tier
+
+    # Cache invalidation
+
+    def invalidate_member(self, guild_id, member_id):
+        """Forget a member's cached tier, e.g. after their roles changed."""
+        self._tiers.pop((guild_id, member_id), None)
+
+    def invalidate_guild(self, guild_id):
+        """Forget every cached tier in a guild, e.g. after a role's permissions changed."""
+        for key in [key for key in self._tiers if key[0] == guild_id]:
+            del self._tiers[key]
+
+    def clear(self):
+        """Forget every cached tier."""
+        self._tiers.clear()
@@ -0,0 +1,230 @@
+"""
+Precompiled samplers for the combat and exercise probability tables.
+
+ATTACK_PROBABILITIES, DEFENSE_PROBABILITIES and EXERCISE_EXP_PROBABILITIES
+map ``(low, high)`` value ranges to probabilities. They are validated when
+this module is imported and every level bracket is compiled into a Walker
+alias table, so a roll is one uniform column pick, one biased coin and one
+``randint`` inside the chosen range.
+
+The tables don't sum to 1. The missing probability mass is made explicit:
+by default it becomes a ``(0, 0)`` outcome (a miss, no block, no EXP);
+pass ``residual="rescale"`` to ``compile_table`` to spread it over the
+listed ranges instead.
+"""
+
+import random
+from bisect import bisect_right
+
+from config import ATTACK_PROBABILITIES, DEFENSE_PROBABILITIES, EXERCISE_EXP_PROBABILITIES
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; only draw_array needs it
+    np = None
+
+# Outcome used for probability mass the tables leave unassigned
+RESIDUAL_OUTCOME = (0, 0)
+
+# Tolerance for probabilities that sum to slightly more than 1
+EPSILON = 1e-9
+
+# Shared RNG used when no other is passed in; reseed with seed()
+_rng = random.Random()
+
+
+def seed(value=None):
+    """Reseed the shared RNG, e.g. for reproducible tests or simulations."""
+    _rng.seed(value)
+
+
+class AliasSampler:
+    """
+    Walker alias table over a fixed list of ``(low, high)`` outcomes.
+    Each draw picks an outcome in O(1) and then a value uniformly inside it.
+    """
+
+    __slots__ = ("outcomes", "weights", "_prob", "_alias", "_np")
+
+    def __init__(self, outcomes, weights):
+        if not outcomes or len(outcomes) != len(weights):
+            raise ValueError("AliasSampler needs one weight per outcome")
+
+        total = sum(weights)
+        if total <= 0:
+            raise ValueError("AliasSampler weights must sum to a positive number")
+
+        self.outcomes = tuple(outcomes)
+        self.weights = tuple(weight / total for weight in weights)
+        self._prob, self._alias = self._build(self.weights)
+        self._np = None
+
+    @staticmethod
+    def _build(weights):
+        """Build the probability and alias columns (Vose's method)."""
+        count = len(weights)
+        scaled = [weight * count for weight in weights]
+        prob = [1.0] * count
+        alias = list(range(count))
+
+        small = [i for i, value in enumerate(scaled) if value < 1.0]
+        large = [i for i, value in enumerate(scaled) if value >= 1.0]
+
+        while small and large:
+            low = small.pop()
+            high = large.pop()
+            prob[low] = scaled[low]
+            alias[low] = high
+            scaled[high] -= 1.0 - scaled[low]
+            (small if scaled[high] < 1.0 else large).append(high)
+
+        # Whatever is left over is 1.0 up to rounding error
+        return tuple(prob), tuple(alias)
+
+    def draw_outcome(self, rng=None):
+        """Return the index of a randomly chosen outcome."""
+        rng = rng or _rng
+        column = rng.randrange(len(self._prob))
+        return column if rng.random() < self._prob[column] else self._alias[column]
+
+    def draw(self, rng=None):
+        """Return one value."""
+        rng = rng or _rng
+        low, high = self.outcomes[self.draw_outcome(rng)]
+        return low if low == high else rng.randint(low, high)
+
+    def draw_many(self, count, rng=None):
+        """Return a list of ``count`` values."""
+        rng = rng or _rng
+        return [self.draw(rng) for _ in range(count)]
+
+    def draw_array(self, count, generator):
+        """
+        Return a NumPy array of ``count`` values drawn with a NumPy Generator.
+        Requires NumPy.
+        """
+        if np is None:
+            raise RuntimeError("draw_array requires NumPy")
+
+        if self._np is None:
+            self._np = (
+                np.array(self._prob),
+                np.array(self._alias),
+                np.array([low for low, _ in self.outcomes]),
+                np.array([high for _, high in self.outcomes])
+            )
+        prob, alias, lows, highs = self._np
+
+        columns = generator.integers(0, len(prob), count)
+        chosen = np.where(generator.random(count) < prob[columns], columns, alias[columns])
+        return generator.integers(lows[chosen], highs[chosen] + 1)
+
+    def mean(self):
+        """Expected value of a draw."""
+        return sum(weight * (low + high) / 2 for weight, (low, high) in zip(self.weights, self.outcomes))
+
+
+def _validate_ranges(table, name):
+    """Check a ``{(low, high): probability}`` table and return the total probability."""
+    total = 0.0
+    for value_range, probability in table.items():
+        if not (isinstance(value_range, tuple) and len(value_range) == 2
+                and all(isinstance(bound, int) for bound in value_range)):
+            raise ValueError(f"{name}: {value_range!r} is not a (low, high) pair of integers")
+        low, high = value_range
+        if low < 0 or low > high:
+            raise ValueError(f"{name}: invalid range {value_range!r}")
+        if not 0 <= probability <= 1:
+            raise ValueError(f"{name}: probability {probability!r} for {value_range!r} is outside [0, 1]")
+        total += probability
+
+    if total > 1 + EPSILON:
+        raise ValueError(f"{name}: probabilities sum to {total:.3f}, more than 1")
+    return total
+
+
+def compile_table(table, name, residual="miss"):
+    """
+    Validate a ``{(low, high): probability}`` table and compile it.
+    ``residual`` decides what happens to missing probability mass:
+    ``"miss"`` assigns it to a ``(0, 0)`` outcome, ``"rescale"`` spreads it
+    proportionally over the listed ranges.
+    """
+    if residual not in ("miss", "rescale"):
+        raise ValueError(f"Unknown residual policy {residual!r}")
+
+    total = _validate_ranges(table, name)
+    outcomes = list(table)
+    weights = list(table.values())
+
+    missing = 1.0 - total
+    if residual == "miss" and missing > EPSILON:
+        outcomes.append(RESIDUAL_OUTCOME)
+        weights.append(missing)
+
+    return AliasSampler(outcomes, weights)
+
+
+class LevelSampler:
+    """
+    One AliasSampler per level bracket.
+    A player uses the bracket of the highest listed level not above their own.
+    """
+
+    __slots__ = ("levels", "samplers")
+
+    def __init__(self, samplers):
+        self.levels = tuple(sorted(samplers))
+        self.samplers = tuple(samplers[level] for level in self.levels)
+
+    def for_level(self, level):
+        """Return the sampler for a player's level."""
+        return self.samplers[max(bisect_right(self.levels, level) - 1, 0)]
+
+    def draw(self, level, rng=None):
+        """Return one value for a player of ``level``."""
+        return self.for_level(level).draw(rng)
+
+
+def compile_level_table(table, fixed_key, name, residual="miss"):
+    """
+    Compile a ``{level: {(low, high): probability}}`` table.
+    A bracket of the form ``{fixed_key: value}`` always yields ``value``.
+    """
+    samplers = {}
+    for level, bracket in table.items():
+        if not isinstance(level, int) or level < 1:
+            raise ValueError(f"{name}: invalid level {level!r}")
+
+        if fixed_key in bracket:
+            if len(bracket) != 1 or not isinstance(bracket[fixed_key], int) or bracket[fixed_key] < 0:
+                raise ValueError(f"{name}: level {level} must only contain a non-negative {fixed_key}")
+            value = bracket[fixed_key]
+            samplers[level] = AliasSampler([(value, value)], [1.0])
+        else:
+            samplers[level] = compile_table(bracket, f"{name}[{level}]", residual)
+
+    if 1 not in samplers:
+        raise ValueError(f"{name}: missing level 1 bracket")
+
+    return LevelSampler(samplers)
+
+
+ATTACK = compile_level_table(ATTACK_PROBABILITIES, "fixed_damage", "ATTACK_PROBABILITIES")
+DEFENSE = compile_level_table(DEFENSE_PROBABILITIES, "fixed_block", "DEFENSE_PROBABILITIES")
+EXERCISE_EXP = compile_table(EXERCISE_EXP_PROBABILITIES, "EXERCISE_EXP_PROBABILITIES")
+
+
+def roll_attack(level, rng=None):
+    """Roll attack damage for a player of ``level``."""
+    return ATTACK.draw(level, rng)
+
+
+def roll_defense(level, rng=None):
+    """Roll the amount blocked by a player of ``level``."""
+    return DEFENSE.draw(level, rng)
+
+
+def roll_exercise_exp(rng=None):
+    """Roll the EXP gained from exercising."""
+    return EXERCISE_EXP.draw(rng)
@@ -0,0 +1,497 @@
+import collections
+import heapq
+import logging
+import os
+import pickle
+import re
+import time
+from pathlib import Path
+
+from config import (DB_SEGMENT_DIR, DB_SEGMENT_COUNT, DB_MAX_RESIDENT_USERS, DB_SEGMENT_LEADERBOARD_SIZE,
+                    DB_SEGMENT_FULL_LEADERBOARD)
+from utils.aggregates import Aggregates
+from utils.db_manager import DatabaseManager, read_pickle_store
+from utils.metrics import DB_INIT_BYTES, DB_INIT_SECONDS
+from utils.user_record import UserRecord
+
+logger = logging.getLogger(__name__)
+
+# Version of the segment index layout; 2 added the per-segment leaderboard
+INDEX_FORMAT = 2
+
+# 2**64 divided by the golden ratio; multiplying by it spreads nearby IDs apart
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+_HASH_MASK = (1 << 64) - 1
+
+# segment-0042.g7.users holds the users of segment 42 as of generation 7, segment-0042.g7.exp their EXP
+_SEGMENT_FILE = re.compile(r"segment-(\d+)\.g(\d+)\.(users|exp)$")
+
+
+def segment_of(user_id, segment_count):
+    """
+    Return the segment a user is stored in.
+    The ID is mixed first: the low bits of a Discord snowflake are a
+    per-process counter and would pile users into a few segments.
+    """
+    return (((user_id * _HASH_MULTIPLIER) & _HASH_MASK) >> 32) % segment_count
+
+
+def _totals(records):
+    """Return the running totals of some users as ``(users, coins, items, levels)`` for the index."""
+    aggregates = Aggregates()
+    for user in records:
+        aggregates.add(user)
+    return aggregates.users, aggregates.coins, aggregates.items, aggregates.levels
+
+
+def _top(entries, size):
+    """Return the ``size`` best ``(user_id, exp)`` pairs, ranked like the Leaderboard."""
+    return heapq.nsmallest(size, entries, key=lambda entry: (-entry[1], entry[0]))
+
+
+def _dump(path, data):
+    """Pickle ``data`` to ``path`` and sync it to disk. Returns the bytes written."""
+    with open(path, 'wb') as f:
+        pickle.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+class SegmentedDatabaseManager(DatabaseManager):
+    """
+    DatabaseManager backed by hash-partitioned segment files.
+
+    Users are spread over ``segment_count`` segments by ``segment_of``. Each
+    segment is a pickle of its users' tuples plus a small pickle of their
+    EXP, and ``index.pkl`` records the current generation, running totals
+    and ``leaderboard_size`` best players of every segment along with the
+    active cooldowns and the guild role configuration. Startup only reads
+    the index; a segment's users are loaded the first time one of them is
+    looked up.
+
+    A save writes every dirty segment as a new generation and then replaces
+    the index, so a crash mid-save leaves the previous index and the files it
+    names intact. Files the index doesn't name are deleted at startup.
+
+    Loaded segments are kept in least recently used order. Once more than
+    ``max_resident_users`` users are in memory, the least recently used
+    segments are dropped again, skipping any with a user that is dirty,
+    locked or part of an open transaction. Dropping a segment leaves the
+    running totals alone; they cover every stored user.
+
+    The leaderboard holds the stored best players of each segment plus the
+    users changed since startup, and evicted users leave it again unless
+    they are among their segment's best. So once pending changes are saved
+    ``top_n`` is exact up to ``leaderboard_size``, and its memory doesn't
+    grow with the store, but other players may be unranked. With ``full_leaderboard`` every user is
+    ranked instead, at the cost of reading every EXP file at startup and
+    keeping one entry per stored user in memory.
+    """
+
+    def __init__(self, segment_dir=DB_SEGMENT_DIR, segment_count=DB_SEGMENT_COUNT,
+                 max_resident_users=DB_MAX_RESIDENT_USERS, leaderboard_size=DB_SEGMENT_LEADERBOARD_SIZE,
+                 full_leaderboard=DB_SEGMENT_FULL_LEADERBOARD, **kwargs):
+        """Initialize the segmented database manager."""
+        super().__init__(**kwargs)
+        self.pickle_path = self.db_path
+        self.segment_dir = Path(segment_dir)
+        self.index_path = self.segment_dir / "index.pkl"
+        self.segment_count = segment_count
+        self.max_resident_users = max_resident_users
+        self.leaderboard_size = leaderboard_size
+        self.full_leaderboard = full_leaderboard
+
+        # The index as last written. Only the writer thread writes it, and it
+        # replaces the dict instead of changing it, so the event loop may read it
+        self._index = None
+
+        # Per-segment best players last merged into the leaderboard
+        self._tops = {}
+
+        # Segments loaded from disk, least recently used first
+        self._loaded = collections.OrderedDict()
+
+        # IDs of the users in memory, per segment
+        self._members = {}
+
+    async def initialize(self):
+        """Read the index, migrating an old pickle database on first start, and rebuild the leaderboard."""
+        started = time.perf_counter()
+
+        user_count, cooldown_rows, self.guild_roles = await self._run_in_writer(self._open)
+        self.cooldowns.load(cooldown_rows, self.clock())
+        logger.info(f"Opened segmented database with {user_count} users in {self.segment_count} segments "
+                    f"and {len(self.cooldowns)} active cooldowns")
+
+        await self.recount_aggregates()
+        await self.rebuild_leaderboard()
+        DB_INIT_BYTES.set(await self._run_in_writer(self._stored_bytes))
+        DB_INIT_SECONDS.set(time.perf_counter() - started)
+
+    def _new_index(self):
+        return {
+            "format": INDEX_FORMAT,
+            "segment_count": self.segment_count,
+            "segments": {},  # segment -> (generation, totals)
+            "leaderboard": {},  # segment -> best (user_id, exp) pairs
+            "cooldowns": [],
+            "guild_roles": {}
+        }
+
+    def _open(self):
+        """
+        Read the index, creating the store on first start. Runs in the writer thread.
+        Returns the number of users, the cooldown rows and the guild role configuration.
+        """
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, 'rb') as f:
+                    self._index = pickle.load(f)
+            except Exception as e:
+                logger.error(f"Error reading segment index: {e}")
+                self._index = self._recover_index()
+        else:
+            self._index = self._new_index()
+            if self.pickle_path.exists() or self.journal_path.exists():
+                self.migrate_from_pickle(self.pickle_path)
+            if not self.index_path.exists():
+                self._write_index(self._index)
+
+        if self._index["format"] < 2:
+            self._add_leaderboard_to_index()
+
+        if self._index["segment_count"] != self.segment_count:
+            logger.warning(f"Segmented database was created with {self._index['segment_count']} segments; "
+                           f"ignoring DB_SEGMENT_COUNT = {self.segment_count}")
+            self.segment_count = self._index["segment_count"]
+
+        self._remove_unused_files()
+
+        user_count = sum(totals[0] for _, totals in self._index["segments"].values())
+        return user_count, self._index["cooldowns"], self._index["guild_roles"]
+
+    def _recover_index(self):
+        """
+        Rebuild an unreadable index from the newest readable generation of
+        every segment. Cooldowns and role configuration are lost.
+        """
+        corrupt_path = self.index_path.with_name(f"{self.index_path.name}.corrupt-{int(self.clock())}")
+        self.index_path.rename(corrupt_path)
+        logger.error(f"Moved unreadable segment index to {corrupt_path}")
+
+        generations = {}
+        for path in self.segment_dir.iterdir():
+            match = _SEGMENT_FILE.match(path.name)
+            if match and match.group(3) == "users":
+                generations.setdefault(int(match.group(1)), []).append(int(match.group(2)))
+
+        index = self._new_index()
+        for segment, found in generations.items():
+            for generation in sorted(found, reverse=True):
+                try:
+                    with open(self._segment_path(segment, generation, "users"), 'rb') as f:
+                        users = pickle.load(f)
+                except Exception as e:
+                    logger.warning(f"Skipping unreadable generation {generation} of segment {segment}: {e}")
+                    continue
+
+                records = [UserRecord.from_tuple(user_id, values) for user_id, values in users.items()]
+                exp = [(user.user_id, user.exp) for user in records]
+                _dump(self._segment_path(segment, generation, "exp"), exp)
+                index["segments"][segment] = (generation, _totals(records))
+                index["leaderboard"][segment] = _top(exp, self.leaderboard_size)
+                break
+
+        self._write_index(index)
+        logger.info(f"Recovered {len(index['segments'])} segments into a new index")
+        return index
+
+    def _add_leaderboard_to_index(self):
+        """Upgrade a format 1 index with the best players of every segment, read from the EXP files."""
+        leaderboard = {
+            segment: _top(self._read_segment_exp(segment), self.leaderboard_size)
+            for segment in self._index["segments"]
+        }
+        self._write_index({**self._index, "format": INDEX_FORMAT, "leaderboard": leaderboard})
+        logger.info(f"Added the leaderboard of {len(leaderboard)} segments to the segment index")
+
+    def _segment_path(self, segment, generation, kind):
+        return self.segment_dir / f"segment-{segment:04d}.g{generation}.{kind}"
+
+    def _remove_unused_files(self):
+        """Delete segment files the index doesn't name, e.g. left behind by a crash mid-save."""
+        segments = self._index["segments"]
+        for path in self.segment_dir.iterdir():
+            match = _SEGMENT_FILE.match(path.name)
+            if match and segments.get(int(match.group(1)), (None,))[0] != int(match.group(2)):
+                path.unlink()
+
+    def _stored_bytes(self):
+        """Size of the files read at startup: the index, plus every segment's EXP file for a full leaderboard."""
+        paths = [self.index_path]
+        if self.full_leaderboard:
+            paths += [
+                self._segment_path(segment, generation, "exp")
+                for segment, (generation, _) in self._index["segments"].items()
+            ]
+        return sum(path.stat().st_size for path in paths if path.exists())
+
+    def _write_index(self, index):
+        """Atomically replace the index. Returns the bytes written."""
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        written = _dump(tmp_path, index)
+        os.replace(tmp_path, self.index_path)
+        self._index = index
+        return written
+
+    def migrate_from_pickle(self, pickle_path, journal_path=None):
+        """
+        Partition every user of a pickle database into segments.
+        The pickle files are renamed afterwards so the migration only runs once.
+        """
+        pickle_path = Path(pickle_path)
+        journal_path = Path(journal_path) if journal_path else self.journal_path
+        try:
+            users, cooldown_rows, guild_roles, _, _ = read_pickle_store(pickle_path, journal_path)
+        except Exception as e:
+            logger.error(f"Error reading pickle database for migration: {e}")
+            return
+
+        changes = {}
+        for user in users.values():
+            changes.setdefault(segment_of(user.user_id, self.segment_count), {})[user.user_id] = user.to_tuple()
+        self._write_snapshot((changes, cooldown_rows, guild_roles))
+
+        for path in (pickle_path, journal_path):
+            if path.exists():
+                path.rename(path.with_name(path.name + ".migrated"))
+        logger.info(f"Migrated {len(users)} users from {pickle_path} into {len(changes)} segments")
+
+    # Loading and eviction
+
+    def _read_segment(self, segment):
+        """Read a segment's ``{user_id: tuple}``. Runs in the writer thread."""
+        entry = self._index["segments"].get(segment)
+        if entry is None:
+            return {}
+
+        with open(self._segment_path(segment, entry[0], "users"), 'rb') as f:
+            return pickle.load(f)
+
+    async def _load_segment(self, segment):
+        """Bring a segment's users into ``self.users``."""
+        users = await self._run_in_writer(self._read_segment, segment)
+
+        members = self._members.setdefault(segment, set())
+        for user_id, values in users.items():
+            # A user already in memory is newer than their stored copy
+            if user_id not in self.users:
+                self.users[user_id] = UserRecord.from_tuple(user_id, values)
+                members.add(user_id)
+
+        self._loaded[segment] = None
+        self._loaded.move_to_end(segment)
+
+    async def _load_user(self, user_id):
+        """Load the user's segment unless it is already in memory."""
+        segment = segment_of(user_id, self.segment_count)
+        if segment not in self._loaded:
+            await self._load_segment(segment)
+
+            if not self._save_running():
+                self._evict()
+
+        return user_id in self.users
+
+    async def _load_all_users(self):
+        """Load every segment that isn't in memory yet. Eviction waits for the next load or save."""
+        for segment in await self._run_in_writer(lambda: list(self._index["segments"])):
+            if segment not in self._loaded:
+                await self._load_segment(segment)
+
+    async def _get_record(self, user_id):
+        """Look up a user and mark their segment as recently used."""
+        user = await super()._get_record(user_id)
+
+        segment = segment_of(user.user_id, self.segment_count)
+        if segment in self._loaded:
+            self._loaded.move_to_end(segment)
+        return user
+
+    def _materialise(self, user):
+        """Store a virtual record and remember which segment holds it."""
+        super()._materialise(user)
+        self._members.setdefault(segment_of(user.user_id, self.segment_count), set()).add(user.user_id)
+
+    def _evict(self):
+        """Drop least recently used segments until the users in memory fit ``max_resident_users``."""
+        if len(self.users) <= self.max_resident_users:
+            return
+
+        pinned = self._pinned_users()
+        evicted = 0
+        # The most recently used segment always stays
+        for segment in list(self._loaded)[:-1]:
+            if len(self.users) <= self.max_resident_users:
+                break
+
+            members = self._members.get(segment, ())
+            if not pinned.isdisjoint(members):
+                continue
+
+            top = {user_id for user_id, _ in self._tops.get(segment, ())}
+            for user_id in members:
+                self.users.pop(user_id, None)
+                if not self.full_leaderboard and user_id not in top:
+                    self.leaderboard.remove(user_id)
+            self._members.pop(segment, None)
+            del self._loaded[segment]
+            evicted += 1
+
+        if evicted:
+            logger.debug(f"Evicted {evicted} segments, {len(self.users)} users left in memory")
+
+    # Saving
+
+    async def _run_saves(self):
+        """Write snapshots, then update the leaderboard and evict segments that are clean now."""
+        await super()._run_saves()
+        if not self.full_leaderboard:
+            self._merge_leaderboard()
+        self._evict()
+
+    def _snapshot(self, dirty, dirty_cooldowns):
+        """Group the dirty users' tuples by segment and copy the cooldowns and role configuration."""
+        changes = {}
+        for user_id in dirty:
+            changes.setdefault(segment_of(user_id, self.segment_count), {})[user_id] = self.users[user_id].to_tuple()
+
+        return (
+            changes,
+            self.cooldowns.rows(self.clock()),
+            {guild_id: dict(roles) for guild_id, roles in self.guild_roles.items()}
+        )
+
+    def _write_snapshot(self, snapshot):
+        """
+        Write every changed segment as a new generation, replace the index and
+        delete the generations it no longer names. Runs in the writer thread.
+        Returns the bytes written.
+        """
+        changes, cooldown_rows, guild_roles = snapshot
+        segments = dict(self._index["segments"])
+        leaderboard = dict(self._index["leaderboard"])
+        replaced = []
+        written = 0
+
+        for segment, changed in changes.items():
+            users = self._read_segment(segment)
+            users.update(changed)
+
+            entry = segments.get(segment)
+            generation = 1
+            if entry is not None:
+                generation = entry[0] + 1
+                replaced.append((segment, entry[0]))
+
+            records = [UserRecord.from_tuple(user_id, values) for user_id, values in users.items()]
+            exp = [(user.user_id, user.exp) for user in records]
+            written += _dump(self._segment_path(segment, generation, "users"), users)
+            written += _dump(self._segment_path(segment, generation, "exp"), exp)
+            segments[segment] = (generation, _totals(records))
+            leaderboard[segment] = _top(exp, self.leaderboard_size)
+
+        written += self._write_index({
+            "format": INDEX_FORMAT,
+            "segment_count": self.segment_count,
+            "segments": segments,
+            "leaderboard": leaderboard,
+            "cooldowns": cooldown_rows,
+            "guild_roles": guild_roles
+        })
+
+        for segment, generation in replaced:
+            for kind in ("users", "exp"):
+                self._segment_path(segment, generation, kind).unlink(missing_ok=True)
+
+        logger.debug(f"Saved {sum(len(changed) for changed in changes.values())} users "
+                     f"in {len(changes)} segments")
+        return written
+
+    async def _write_guild_roles(self, guild_id, roles):
+        """Persist the role configuration by rewriting the index."""
+        await self._run_in_writer(self._write_snapshot, (
+            {},
+            self.cooldowns.rows(self.clock()),
+            {guild_id: dict(roles) for guild_id, roles in self.guild_roles.items()}
+        ))
+
+    # Totals
+
+    def _count_aggregates(self):
+        """Add up the running totals of every segment. Runs in the writer thread."""
+        aggregates = Aggregates()
+        for _, (users, coins, items, levels) in self._index["segments"].values():
+            aggregates.users += users
+            aggregates.coins += coins
+            for item_id, quantity in items.items():
+                aggregates.items[item_id] = aggregates.items.get(item_id, 0) + quantity
+            for level, count in levels.items():
+                aggregates.levels[level] = aggregates.levels.get(level, 0) + count
+        return aggregates
+
+    async def recount_aggregates(self):
+        """Rebuild the running totals from the index, after flushing pending changes."""
+        await self.flush()
+        self.aggregates = await self._run_in_writer(self._count_aggregates)
+
+    def _read_segment_exp(self, segment):
+        """Read a segment's ``(user_id, exp)`` pairs. Runs in the writer thread."""
+        generation, _ = self._index["segments"][segment]
+        with open(self._segment_path(segment, generation, "exp"), 'rb') as f:
+            return pickle.load(f)
+
+    def _read_exp(self):
+        """Read every segment's EXP file. Runs in the writer thread."""
+        entries = []
+        for segment in self._index["segments"]:
+            entries.extend(self._read_segment_exp(segment))
+        return entries
+
+    async def rebuild_leaderboard(self):
+        """
+        Rebuild the EXP leaderboard after flushing pending changes: from the
+        best players in the index, or from every EXP file for a full leaderboard.
+        """
+        await self.flush()
+        if self.full_leaderboard:
+            self.leaderboard.rebuild(await self._run_in_writer(self._read_exp))
+            return
+
+        self._tops = {}
+        self.leaderboard.rebuild(())
+        self._merge_leaderboard()
+
+    def _merge_leaderboard(self):
+        """
+        Bring the leaderboard up to date with the best players of segments
+        rewritten since the last merge. Users in memory are ranked by their
+        current EXP, which may be newer than the saved one, and stay ranked
+        until their segment is evicted.
+        """
+        for segment, top in self._index["leaderboard"].items():
+            previous = self._tops.get(segment, ())
+            if previous is top:
+                continue
+
+            current = {user_id for user_id, _ in top}
+            for user_id, _ in previous:
+                if user_id not in current and user_id not in self.users:
+                    self.leaderboard.remove(user_id)
+            for user_id, exp in top:
+                user = self.users.get(user_id)
+                self.leaderboard.update(user_id, exp if user is None else user.exp)
+            self._tops[segment] = top
@@ -0,0 +1,359 @@
+import json
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+from config import DB_CACHE_SIZE, DB_CACHE_TTL
+from utils.aggregates import Aggregates
+from utils.cooldowns import COOLDOWN_DURATIONS
+from utils.db_manager import DatabaseManager, read_pickle_store
+from utils.metrics import DB_INIT_BYTES, DB_INIT_SECONDS
+from utils.user_cache import UserCache
+from utils.user_record import UserRecord
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    hp INTEGER NOT NULL,
+    energy INTEGER NOT NULL,
+    exp INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    coins INTEGER,
+    last_regen_at REAL,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS inventories (
+    user_id INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (user_id, item_id)
+);
+CREATE TABLE IF NOT EXISTS cooldowns (
+    user_id INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (user_id, command)
+);
+CREATE TABLE IF NOT EXISTS guild_roles (
+    guild_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    role_id INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, kind, role_id)
+);
+"""
+
+# Created after _upgrade_cooldowns, since older databases lack the column
+COOLDOWN_EXPIRY_INDEX = "CREATE INDEX IF NOT EXISTS cooldowns_expires_at ON cooldowns (expires_at)"
+
+
+class SQLiteDatabaseManager(DatabaseManager):
+    """
+    DatabaseManager backed by SQLite instead of a pickle file.
+
+    Users are loaded into memory the first time they are looked up, and a
+    save only rewrites the rows of the users that changed, so the cost of a
+    single-stat update no longer depends on the size of the database.
+
+    Loaded users stay in memory while they are in use: a UserCache drops
+    users idle for ``cache_ttl`` seconds, or the least recently used ones
+    beyond ``cache_size``, unless they are dirty, locked or part of an open
+    transaction. Lookups of cached users never touch the database.
+    """
+
+    def __init__(self, db_path="rpg_database.sqlite3", cache_size=DB_CACHE_SIZE, cache_ttl=DB_CACHE_TTL, **kwargs):
+        """Initialize the SQLite database manager."""
+        super().__init__(**kwargs)
+        self.pickle_path = self.db_path
+        self.db_path = Path(db_path)
+        self.conn = None
+        self.cache = UserCache(cache_size, cache_ttl)
+
+    async def initialize(self):
+        """Open the database, create the tables and migrate an old pickle file."""
+        started = time.perf_counter()
+        DB_INIT_BYTES.set(self._stored_bytes())
+
+        user_count, cooldown_rows, role_rows = await self._run_in_writer(self._open, self.clock())
+        self.cooldowns.load(cooldown_rows, self.clock())
+
+        guild_roles = {}
+        for guild_id, kind, role_id in role_rows:
+            guild_roles.setdefault(guild_id, {}).setdefault(kind, set()).add(role_id)
+        self.guild_roles = {
+            guild_id: {kind: frozenset(role_ids) for kind, role_ids in roles.items()}
+            for guild_id, roles in guild_roles.items()
+        }
+        logger.info(f"Opened SQLite database with {user_count} users and {len(self.cooldowns)} active cooldowns")
+
+        await self.recount_aggregates()
+        await self.rebuild_leaderboard()
+        DB_INIT_SECONDS.set(time.perf_counter() - started)
+
+    def _stored_bytes(self):
+        """Total size of the database file and its write-ahead log."""
+        wal_path = self.db_path.with_name(self.db_path.name + "-wal")
+        return sum(path.stat().st_size for path in (self.db_path, wal_path) if path.exists())
+
+    def _open(self, now):
+        """
+        Open the connection and prepare the schema. Runs in the writer thread.
+        Returns the number of users, the rows of every active cooldown and
+        the guild role rows.
+        """
+        # The connection is only ever used from the writer thread
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._upgrade_cooldowns()
+        self.conn.execute(COOLDOWN_EXPIRY_INDEX)
+
+        user_count = self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if user_count == 0 and (self.pickle_path.exists() or self.journal_path.exists()):
+            self.migrate_from_pickle(self.pickle_path)
+            user_count = self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        with self.conn:
+            self.conn.execute("DELETE FROM cooldowns WHERE expires_at <= ?", (now,))
+        cooldown_rows = self.conn.execute(
+            "SELECT user_id, command, timestamp, expires_at FROM cooldowns").fetchall()
+        role_rows = self.conn.execute("SELECT guild_id, kind, role_id FROM guild_roles").fetchall()
+
+        return user_count, cooldown_rows, role_rows
+
+    def _upgrade_cooldowns(self):
+        """Add the expires_at column to a cooldowns table created before it existed."""
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(cooldowns)")]
+        if "expires_at" in columns:
+            return
+
+        with self.conn:
+            self.conn.execute("ALTER TABLE cooldowns ADD COLUMN expires_at REAL")
+            self.conn.executemany(
+                "UPDATE cooldowns SET expires_at = timestamp + ? WHERE command = ?",
+                [(duration, command) for command, duration in COOLDOWN_DURATIONS.items()]
+            )
+        logger.info("Added cooldown expiry times to the SQLite database")
+
+    def migrate_from_pickle(self, pickle_path, journal_path=None):
+        """
+        Import every user from a pickle database in one transaction.
+        The pickle files are renamed afterwards so the migration only runs once.
+        """
+        pickle_path = Path(pickle_path)
+        journal_path = Path(journal_path) if journal_path else self.journal_path
+        try:
+            users, cooldown_rows, guild_roles, _, _ = read_pickle_store(pickle_path, journal_path)
+        except Exception as e:
+            logger.error(f"Error reading pickle database for migration: {e}")
+            return
+
+        with self.conn:
+            for user in users.values():
+                self._write_user(user)
+            self._write_cooldowns(cooldown_rows)
+            for guild_id, roles in guild_roles.items():
+                self._replace_guild_roles(guild_id, roles)
+
+        for path in (pickle_path, journal_path):
+            if path.exists():
+                path.rename(path.with_name(path.name + ".migrated"))
+        logger.info(f"Migrated {len(users)} users from {pickle_path}")
+
+    def _write_user(self, user):
+        """Write one user's rows. Must be called inside a transaction."""
+        user_id = user.user_id
+        inventory = user.inventory or {}
+
+        # Any stat without its own column is kept as JSON
+        self.conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, hp, energy, exp, level, coins, last_regen_at, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, user.hp, user.energy, user.exp, user.level, user.coins, user.last_regen_at,
+             json.dumps(user.extra) if user.extra else None)
+        )
+
+        self.conn.execute("DELETE FROM inventories WHERE user_id = ?", (user_id,))
+        self.conn.executemany(
+            "INSERT INTO inventories (user_id, item_id, quantity) VALUES (?, ?, ?)",
+            [(user_id, item_id, quantity) for item_id, quantity in inventory.items()]
+        )
+
+    def _write_cooldowns(self, rows):
+        """
+        Write ``(user_id, command, timestamp, expires_at)`` rows; a None
+        timestamp deletes the cooldown. Must be called inside a transaction.
+        """
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO cooldowns (user_id, command, timestamp, expires_at) VALUES (?, ?, ?, ?)",
+            [row for row in rows if row[2] is not None]
+        )
+        self.conn.executemany(
+            "DELETE FROM cooldowns WHERE user_id = ? AND command = ?",
+            [(user_id, command) for user_id, command, timestamp, _ in rows if timestamp is None]
+        )
+
+    def _replace_guild_roles(self, guild_id, roles):
+        """Replace a guild's role rows. Must be called inside a transaction."""
+        self.conn.execute("DELETE FROM guild_roles WHERE guild_id = ?", (guild_id,))
+        self.conn.executemany(
+            "INSERT INTO guild_roles (guild_id, kind, role_id) VALUES (?, ?, ?)",
+            [(guild_id, kind, role_id) for kind, role_ids in roles.items() for role_id in role_ids]
+        )
+
+    def _commit_guild_roles(self, guild_id, roles):
+        """Write a guild's role rows in their own transaction. Runs in the writer thread."""
+        with self.conn:
+            self._replace_guild_roles(guild_id, roles)
+
+    async def _write_guild_roles(self, guild_id, roles):
+        """Persist a guild's role configuration."""
+        await self._run_in_writer(self._commit_guild_roles, guild_id, roles)
+
+    def _store_rows(self, user_row, inventory_rows):
+        """Put rows read from SQLite into ``self.users``."""
+        user_id, hp, energy, exp, level, coins, last_regen_at, extra = user_row
+        self.users[user_id] = UserRecord(
+            user_id, hp, energy, exp, level, coins, last_regen_at,
+            inventory=dict(inventory_rows) or None,
+            extra=json.loads(extra) if extra else None
+        )
+        self.cache.touch(user_id, self.clock())
+
+    def _read_user(self, key):
+        """Read one user's rows. Runs in the writer thread."""
+        user_row = self.conn.execute(
+            "SELECT user_id, hp, energy, exp, level, coins, last_regen_at, extra FROM users WHERE user_id = ?",
+            (key,)
+        ).fetchone()
+        if user_row is None:
+            return None
+
+        inventory_rows = self.conn.execute(
+            "SELECT item_id, quantity FROM inventories WHERE user_id = ?", (key,)
+        ).fetchall()
+
+        return user_row, inventory_rows
+
+    async def _load_user(self, user_id):
+        """Load a single user and their inventory, then evict expired users."""
+        self.cache.miss()
+        rows = await self._run_in_writer(self._read_user, int(user_id))
+        if rows is None:
+            return False
+
+        # Another command may have loaded the user while we were waiting
+        if user_id not in self.users:
+            self._store_rows(*rows)
+            self._evict()
+        return True
+
+    async def _get_record(self, user_id):
+        """Look up a user, counting cache hits and marking the user as recently used."""
+        user_id = int(user_id)
+        if user_id in self.users or user_id in self._virtual:
+            self.cache.hit()
+
+        user = await super()._get_record(user_id)
+        if user_id in self.users:
+            self.cache.touch(user_id, self.clock())
+        return user
+
+    def _materialise(self, user):
+        """Store a virtual record and start tracking it in the cache."""
+        super()._materialise(user)
+        self.cache.touch(user.user_id, self.clock())
+
+    def _evict(self):
+        """Drop the users the cache has expired. Waits while a save is running."""
+        if self._save_running():
+            return
+
+        for user_id in self.cache.evict(self.clock(), self._pinned_users()):
+            self.users.pop(user_id, None)
+
+    async def flush(self):
+        """Write out any pending changes, then evict users that are clean and expired."""
+        await super().flush()
+        self._evict()
+
+    def _read_all(self):
+        """Read every user's rows, grouped by user. Runs in the writer thread."""
+        inventories = {}
+        for user_id, item_id, quantity in self.conn.execute(
+                "SELECT user_id, item_id, quantity FROM inventories"):
+            inventories.setdefault(user_id, []).append((item_id, quantity))
+
+        return [
+            (user_row, inventories.get(user_row[0], []))
+            for user_row in self.conn.execute(
+                "SELECT user_id, hp, energy, exp, level, coins, last_regen_at, extra FROM users")
+        ]
+
+    async def _load_all_users(self):
+        """Load every user that isn't in memory yet."""
+        for rows in await self._run_in_writer(self._read_all):
+            if rows[0][0] not in self.users:
+                self._store_rows(*rows)
+
+    def _snapshot(self, dirty, dirty_cooldowns):
+        """Copy the records of the dirty users and the entries of the dirty cooldowns."""
+        cooldown_rows = []
+        for user_id, command in dirty_cooldowns:
+            timestamp, expires_at = self.cooldowns.entry(user_id, command) or (None, None)
+            cooldown_rows.append((user_id, command, timestamp, expires_at))
+
+        return [self.users[user_id].copy() for user_id in dirty], cooldown_rows, self.clock()
+
+    def _write_snapshot(self, snapshot):
+        """
+        Write the dirty users and cooldowns in a single transaction, and drop
+        cooldowns that have expired. Runs in the writer thread.
+        """
+        users, cooldown_rows, now = snapshot
+        if (not users and not cooldown_rows) or self.conn is None:
+            return
+
+        with self.conn:
+            for user in users:
+                self._write_user(user)
+            if cooldown_rows:
+                self._write_cooldowns(cooldown_rows)
+                self.conn.execute("DELETE FROM cooldowns WHERE expires_at <= ?", (now,))
+        logger.debug(f"Saved {len(users)} users and {len(cooldown_rows)} cooldowns to SQLite")
+
+    def _count_aggregates(self):
+        """Compute the running totals in SQL. Runs in the writer thread."""
+        aggregates = Aggregates()
+        aggregates.users, aggregates.coins = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(coins), 0) FROM users").fetchone()
+        aggregates.levels = dict(self.conn.execute(
+            "SELECT level, COUNT(*) FROM users GROUP BY level"))
+        aggregates.items = dict(self.conn.execute(
+            "SELECT item_id, SUM(quantity) FROM inventories GROUP BY item_id"))
+        return aggregates
+
+    async def recount_aggregates(self):
+        """Rebuild the running totals from the database, after flushing pending changes."""
+        await self.flush()
+        self.aggregates = await self._run_in_writer(self._count_aggregates)
+
+    def _read_exp(self):
+        """Read every user's EXP. Runs in the writer thread."""
+        return self.conn.execute("SELECT user_id, exp FROM users").fetchall()
+
+    async def rebuild_leaderboard(self):
+        """Rebuild the EXP leaderboard from the database, after flushing pending changes."""
+        await self.flush()
+        self.leaderboard.rebuild(await self._run_in_writer(self._read_exp))
+
+    async def close(self):
+        """Flush pending changes and close the connection."""
+        await super().close()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
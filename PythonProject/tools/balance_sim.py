@@ -0,0 +1,199 @@
+"""
+Monte-Carlo balance simulator for the combat settings in config.py.
+
+For every pair of attacker/defender level brackets in ATTACK_PROBABILITIES
+and DEFENSE_PROBABILITIES it simulates attack/defend exchanges with NumPy
+batch sampling and reports:
+
+- expected damage per exchange and how often an attack gets through,
+- exchanges and wall-clock time needed to knock out a full-HP defender,
+  taking ATTACK_ENERGY_COST / ENERGY_REGEN_RATE and HP_REGEN_RATE into account,
+- whether the attacker can sustain the damage on energy regeneration alone.
+
+An exchange is modelled as one attack roll against one defense roll; the
+defender loses ``max(damage - block, 0)`` HP. The attacker starts with
+MAX_ENERGY, spends ATTACK_ENERGY_COST per attack and regenerates at
+ENERGY_REGEN_RATE per ENERGY_REGEN_INTERVAL, while the defender regenerates
+HP_REGEN_RATE per HP_REGEN_INTERVAL.
+
+Results can be saved as a baseline and later runs compared against it, so a
+config change that shifts the balance fails CI:
+
+    python -m tools.balance_sim --write-baseline balance_baseline.json
+    python -m tools.balance_sim --baseline balance_baseline.json --tolerance 0.05
+
+Requires NumPy.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from config import (
+    MAX_HP, MAX_ENERGY,
+    ATTACK_ENERGY_COST, DEFENSE_ENERGY_COST,
+    HP_REGEN_RATE, HP_REGEN_INTERVAL,
+    ENERGY_REGEN_RATE, ENERGY_REGEN_INTERVAL
+)
+from utils.samplers import ATTACK, DEFENSE
+
+# Longest fight followed when measuring exchanges to KO
+MAX_EXCHANGES = 200
+
+# Metrics compared against a baseline
+BASELINE_METRICS = ("mean_damage", "hit_rate", "median_exchanges_to_ko")
+
+
+def simulate_pair(attacker_level, defender_level, exchanges, ko_trials, generator):
+    """Simulate one attacker/defender bracket pair and return its metrics."""
+    attack = ATTACK.for_level(attacker_level)
+    defense = DEFENSE.for_level(defender_level)
+
+    damage = np.maximum(attack.draw_array(exchanges, generator) - defense.draw_array(exchanges, generator), 0)
+    mean_damage = float(damage.mean())
+
+    # Exchanges until the cumulative damage reaches MAX_HP, per fight
+    fights = np.maximum(
+        attack.draw_array(ko_trials * MAX_EXCHANGES, generator)
+        - defense.draw_array(ko_trials * MAX_EXCHANGES, generator),
+        0
+    ).reshape(ko_trials, MAX_EXCHANGES)
+    knocked_out = np.cumsum(fights, axis=1) >= MAX_HP
+    finished = knocked_out.any(axis=1)
+    exchanges_to_ko = np.where(finished, knocked_out.argmax(axis=1) + 1, np.inf)
+    median_exchanges = float(np.median(exchanges_to_ko))
+
+    return {
+        "attacker_level": attacker_level,
+        "defender_level": defender_level,
+        "mean_damage": mean_damage,
+        "hit_rate": float((damage > 0).mean()),
+        "ko_rate": float(finished.mean()),
+        "median_exchanges_to_ko": median_exchanges,
+        **sustainability(mean_damage, median_exchanges)
+    }
+
+
+def sustainability(mean_damage, exchanges_to_ko):
+    """
+    Work out how long a KO takes on energy regeneration, and whether the
+    attacker out-damages the defender's HP regeneration at all.
+    """
+    burst_attacks = MAX_ENERGY // ATTACK_ENERGY_COST
+    attacks_per_hour = ENERGY_REGEN_RATE * 3600 / ENERGY_REGEN_INTERVAL / ATTACK_ENERGY_COST
+    defends_per_hour = ENERGY_REGEN_RATE * 3600 / ENERGY_REGEN_INTERVAL / DEFENSE_ENERGY_COST
+    hp_regen_per_hour = HP_REGEN_RATE * 3600 / HP_REGEN_INTERVAL
+    net_damage_per_hour = attacks_per_hour * mean_damage - hp_regen_per_hour
+
+    if exchanges_to_ko == float("inf"):
+        hours_to_ko = float("inf")
+    elif exchanges_to_ko <= burst_attacks:
+        hours_to_ko = 0.0
+    elif net_damage_per_hour <= 0:
+        hours_to_ko = float("inf")
+    else:
+        # HP left after the opening burst, worn down at the sustained rate
+        remaining_hp = max(MAX_HP - burst_attacks * mean_damage, 0)
+        hours_to_ko = remaining_hp / net_damage_per_hour
+
+    return {
+        "burst_attacks": burst_attacks,
+        "attacks_per_hour": attacks_per_hour,
+        "defends_per_hour": defends_per_hour,
+        "sustainable": net_damage_per_hour > 0,
+        "hours_to_ko": hours_to_ko
+    }
+
+
+def run(exchanges, ko_trials, seed):
+    """Simulate every bracket pair and return the results and exchanges per second."""
+    generator = np.random.default_rng(seed)
+    started = time.perf_counter()
+
+    results = [
+        simulate_pair(attacker_level, defender_level, exchanges, ko_trials, generator)
+        for attacker_level in ATTACK.levels
+        for defender_level in DEFENSE.levels
+    ]
+
+    elapsed = time.perf_counter() - started
+    total = len(results) * (exchanges + ko_trials * MAX_EXCHANGES)
+    return results, total / elapsed
+
+
+def compare(results, baseline, tolerance):
+    """Return a description of every metric that moved more than ``tolerance`` (relative)."""
+    expected = {(row["attacker_level"], row["defender_level"]): row for row in baseline}
+    regressions = []
+
+    for row in results:
+        key = (row["attacker_level"], row["defender_level"])
+        if key not in expected:
+            regressions.append(f"L{key[0]} vs L{key[1]}: not in baseline")
+            continue
+
+        for metric in BASELINE_METRICS:
+            old, new = expected[key][metric], row[metric]
+            if old == new:
+                continue
+            if old in (None, float("inf")) or new == float("inf") or abs(new - old) > tolerance * max(abs(old), 1e-9):
+                regressions.append(f"L{key[0]} vs L{key[1]}: {metric} {old} -> {new}")
+
+    return regressions
+
+
+def format_hours(hours):
+    return "never" if hours == float("inf") else f"{hours:.1f}h"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exchanges", type=int, default=1_000_000, help="Exchanges per bracket pair")
+    parser.add_argument("--ko-trials", type=int, default=10_000, help="Full fights per bracket pair")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--write-baseline", help="Save the results as a baseline")
+    parser.add_argument("--baseline", help="Compare against a saved baseline and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Allowed relative change per metric")
+    args = parser.parse_args()
+
+    results, rate = run(args.exchanges, args.ko_trials, args.seed)
+
+    print(f"{'attacker':>8} {'defender':>8} {'damage':>7} {'hit':>5} {'KO in':>6} {'KO time':>8} {'sustainable':>11}")
+    for row in results:
+        print(f"{row['attacker_level']:>8} {row['defender_level']:>8} {row['mean_damage']:>7.2f} "
+              f"{row['hit_rate']:>5.0%} {row['median_exchanges_to_ko']:>6} {format_hours(row['hours_to_ko']):>8} "
+              f"{'yes' if row['sustainable'] else 'no':>11}")
+    print(f"Simulated {rate / 1e6:.1f}M exchanges/s")
+
+    # JSON has no infinity; store unreachable KOs as null
+    serialisable = [
+        {key: (None if value == float("inf") else value) for key, value in row.items()}
+        for row in results
+    ]
+    for path in (args.json, args.write_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(serialisable, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(
+            results,
+            [{key: (float("inf") if value is None else value) for key, value in row.items()} for row in baseline],
+            args.tolerance
+        )
+        if regressions:
+            print("Balance changed beyond tolerance:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("Balance matches the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import collections
+
+from config import DB_CACHE_SIZE, DB_CACHE_TTL
+from utils.metrics import DB_CACHE_EVICTIONS, DB_CACHE_HITS, DB_CACHE_MISSES
+
+
+class UserCache:
+    """
+    Residency bookkeeping for users a backend loads on demand.
+
+    The records themselves live in ``DatabaseManager.users``; this only
+    remembers when each one was last used, least recently used first, so the
+    manager can drop users that haven't been used for ``ttl`` seconds or
+    that don't fit in ``max_size``. Records are changed in place and written
+    out by the flusher, so a cached record is never stale and mutators have
+    nothing to invalidate.
+
+    Hits, misses and evictions are counted here and in /metrics.
+    """
+
+    def __init__(self, max_size=DB_CACHE_SIZE, ttl=DB_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._used = collections.OrderedDict()  # user_id -> time of last use
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._used)
+
+    def __contains__(self, user_id):
+        return user_id in self._used
+
+    def hit(self):
+        """Count a lookup answered from memory."""
+        self.hits += 1
+        DB_CACHE_HITS.inc()
+
+    def miss(self):
+        """Count a lookup that had to read from the database."""
+        self.misses += 1
+        DB_CACHE_MISSES.inc()
+
+    def touch(self, user_id, now):
+        """Record that a user was used at ``now``."""
+        self._used[user_id] = now
+        self._used.move_to_end(user_id)
+
+    def discard(self, user_id):
+        """Forget a user without counting an eviction."""
+        self._used.pop(user_id, None)
+
+    def evict(self, now, pinned=()):
+        """
+        Forget users, least recently used first, while the cache is over
+        ``max_size`` or the user has been idle for ``ttl`` seconds. Users in
+        ``pinned`` are skipped. Returns the IDs of the users forgotten.
+        """
+        excess = len(self._used) - self.max_size
+        evicted = []
+        for user_id, used_at in self._used.items():
+            if excess <= 0 and now - used_at < self.ttl:
+                break
+            if user_id in pinned:
+                continue
+            evicted.append(user_id)
+            excess -= 1
+
+        for user_id in evicted:
+            del self._used[user_id]
+
+        if evicted:
+            self.evictions += len(evicted)
+            DB_CACHE_EVICTIONS.inc(len(evicted))
+        return evicted
+
+    def stats(self):
+        """Return the counters and the current size."""
+        return {
+            "size": len(self._used),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
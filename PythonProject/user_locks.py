@@ -0,0 +1,75 @@
+import asyncio
+import contextlib
+
+
+class _LockEntry:
+    """An asyncio lock plus the bookkeeping needed to make it reentrant and evictable."""
+
+    __slots__ = ("lock", "users", "owner", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # Tasks holding or waiting for the lock
+        self.owner = None
+        self.depth = 0
+
+
+class UserLockRegistry:
+    """
+    Per-user asyncio locks for read-modify-write sequences.
+
+    Locks are created the first time a user is locked and dropped as soon
+    as no task holds or waits for them, so the registry only ever holds
+    locks for users with a command in flight. Commands for different users
+    never wait on each other.
+
+    Locks are reentrant per task: a command holding a user's lock can call
+    DatabaseManager helpers that lock the same user without deadlocking.
+    """
+
+    def __init__(self):
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def __contains__(self, user_id):
+        """True while a task holds or waits for the user's lock."""
+        return user_id in self._locks
+
+    def __iter__(self):
+        """Iterate over the IDs of users with a lock held or waited for."""
+        return iter(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def lock(self, user_id):
+        """Hold the lock for ``user_id`` for the duration of the block."""
+        task = asyncio.current_task()
+        entry = self._locks.get(user_id)
+
+        if entry is not None and entry.owner is task:
+            entry.depth += 1
+            try:
+                yield
+            finally:
+                entry.depth -= 1
+            return
+
+        if entry is None:
+            entry = self._locks[user_id] = _LockEntry()
+
+        entry.users += 1
+        try:
+            async with entry.lock:
+                entry.owner = task
+                entry.depth = 1
+                try:
+                    yield
+                finally:
+                    entry.owner = None
+                    entry.depth = 0
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                # Idle: nobody holds or waits for this lock any more
+                del self._locks[user_id]
@@ -0,0 +1,129 @@
+from collections.abc import MutableMapping
+
+from config import MAX_HP, MAX_ENERGY
+
+STAT_FIELDS = ("hp", "energy", "exp", "level", "coins", "last_regen_at")
+
+
+class UserRecord(MutableMapping):
+    """
+    Compact in-memory record for one user.
+
+    Stats, coins and inventory live together on a slotted object keyed by
+    the integer user ID. Inventory and any extra stats stay None until they
+    are first needed, so an idle member costs a single small object.
+    Cooldowns are kept separately in a CooldownStore.
+
+    The record also behaves like the old per-user dict (``user['hp']``,
+    ``'coins' in user``), so code written against that layout keeps working.
+    Stats that have no slot of their own are kept in ``extra``.
+    """
+
+    __slots__ = ("user_id", "hp", "energy", "exp", "level", "coins", "last_regen_at",
+                 "inventory", "extra")
+
+    def __init__(self, user_id, hp=MAX_HP, energy=MAX_ENERGY, exp=0, level=1, coins=None,
+                 last_regen_at=None, inventory=None, extra=None):
+        self.user_id = user_id
+        self.hp = hp
+        self.energy = energy
+        self.exp = exp
+        self.level = level
+        self.coins = coins
+        self.last_regen_at = last_regen_at
+        self.inventory = inventory
+        self.extra = extra
+
+    # Mapping view over the stats
+
+    def __getitem__(self, key):
+        if key in STAT_FIELDS:
+            value = getattr(self, key)
+            if value is None:
+                raise KeyError(key)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in STAT_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in STAT_FIELDS:
+            if getattr(self, key) is None:
+                raise KeyError(key)
+            setattr(self, key, None)
+        else:
+            if self.extra is None:
+                raise KeyError(key)
+            del self.extra[key]
+
+    def __iter__(self):
+        for key in STAT_FIELDS:
+            if getattr(self, key) is not None:
+                yield key
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"UserRecord({self.user_id}, {dict(self)!r})"
+
+    # Inventory
+
+    def get_inventory(self):
+        """Return the inventory dict, creating it on first use."""
+        if self.inventory is None:
+            self.inventory = {}
+        return self.inventory
+
+    # Copying and serialisation
+
+    def copy(self):
+        """Return an independent copy, including the inventory."""
+        return UserRecord.from_tuple(self.user_id, self.to_tuple())
+
+    def restore(self, other):
+        """Overwrite this record in place with the contents of ``other``."""
+        for slot in self.__slots__:
+            setattr(self, slot, getattr(other, slot))
+
+    def to_tuple(self):
+        """
+        Return the record as a tuple of builtins for storage.
+        Empty inventories are stored as None.
+        """
+        return (
+            self.hp, self.energy, self.exp, self.level, self.coins, self.last_regen_at,
+            dict(self.inventory) if self.inventory else None,
+            dict(self.extra) if self.extra else None
+        )
+
+    @classmethod
+    def from_tuple(cls, user_id, values):
+        """Build a record from the output of ``to_tuple``."""
+        return cls(user_id, *values)
+
+    @classmethod
+    def from_dict(cls, user_id, user, inventory=None):
+        """Build a record from the old dict-per-user layout."""
+        extra = {key: value for key, value in user.items() if key not in STAT_FIELDS}
+        return cls(
+            int(user_id),
+            hp=user.get("hp", MAX_HP),
+            energy=user.get("energy", MAX_ENERGY),
+            exp=user.get("exp", 0),
+            level=user.get("level", 1),
+            coins=user.get("coins"),
+            last_regen_at=user.get("last_regen_at"),
+            inventory=dict(inventory) if inventory else None,
+            extra=extra or None
+        )
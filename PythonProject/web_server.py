@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+from config import WEB_HOST, WEB_PORT, SELF_PING_INTERVAL
+from utils.metrics import render as render_metrics
+
+logger = logging.getLogger(__name__)
+
+
+def self_ping_url(port):
+    """Return the public Replit URL when running on Replit, or the local server otherwise."""
+    if os.environ.get("REPLIT_URL"):
+        return os.environ["REPLIT_URL"]
+    if os.environ.get("REPL_SLUG") and os.environ.get("REPL_OWNER"):
+        return f"https://{os.environ['REPL_SLUG']}.{os.environ['REPL_OWNER']}.repl.co"
+    return f"http://127.0.0.1:{port}"
+
+
+class WebServer:
+    """
+    HTTP server running on the bot's own event loop.
+
+    Replaces the Flask keep-alive and dashboard threads: ``/``, ``/health``,
+    ``/status``, ``/api/stats`` and ``/metrics`` are answered straight from
+    the bot and its in-memory DatabaseManager. The self-ping used to keep the
+    repl awake is a task on the same loop sharing one pooled client session.
+    """
+
+    def __init__(self, bot, host=WEB_HOST, port=WEB_PORT, ping_interval=SELF_PING_INTERVAL):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self.ping_interval = ping_interval
+        self.started_at = time.time()
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get("/", self.home),
+            web.get("/health", self.health),
+            web.get("/status", self.status),
+            web.get("/api/stats", self.stats),
+            web.get("/metrics", self.metrics)
+        ])
+
+        self._runner = None
+        self._session = None
+        self._ping_task = None
+
+    async def start(self):
+        """Start serving and start the self-ping task."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Web server listening on {self.host}:{self.port}")
+
+        if self.ping_interval:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+            self._ping_task = asyncio.get_running_loop().create_task(self._ping_loop())
+
+    async def close(self):
+        """Stop the self-ping task and the server."""
+        if self._ping_task is not None:
+            self._ping_task.cancel()
+            try:
+                await self._ping_task
+            except asyncio.CancelledError:
+                pass
+            self._ping_task = None
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _ping_loop(self):
+        """Ping our own /health endpoint so hosting doesn't idle the bot."""
+        ping_url = f"{self_ping_url(self.port)}/health"
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                async with self._session.get(ping_url) as response:
+                    if response.status == 200:
+                        logger.debug(f"Self-ping status: {response.status}")
+                    else:
+                        logger.warning(f"Self-ping returned status code: {response.status}")
+            except Exception as e:
+                logger.error(f"Error pinging self: {e}")
+
+    # Routes
+
+    async def home(self, request):
+        """Simple endpoint for uptime services to ping."""
+        return web.Response(text="Bot is alive!")
+
+    async def health(self, request):
+        """Health check endpoint for monitoring."""
+        latency = self.bot.latency
+        return web.json_response({
+            "status": "healthy",
+            "timestamp": time.time(),
+            "ready": self.bot.is_ready(),
+            "latency": latency if math.isfinite(latency) else None
+        })
+
+    async def status(self, request):
+        """Status endpoint for monitoring services."""
+        return web.json_response({
+            "status": "online",
+            "bot": "STATBOT",
+            "version": "1.0.0",
+            "uptime": time.time() - self.started_at,
+            "guilds": len(self.bot.guilds)
+        })
+
+    async def stats(self, request):
+        """Aggregate bot statistics, from the running DatabaseManager."""
+        try:
+            return web.json_response(self.bot.db_manager.get_stats())
+        except Exception as e:
+            logger.error(f"Error loading stats: {e}")
+            return web.json_response({"error": "Failed to load stats"}, status=500)
+
+    async def metrics(self, request):
+        """Command, database and event loop metrics in the Prometheus text format."""
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")